@@ -1,6 +1,11 @@
+import copy
+import hashlib
+import json
+import os
+import time
+
 import streamlit as st
 import pandas as pd
-import ollama
 
 example_files = {
     "Patient Panel": "data/patient_panel.csv",
@@ -11,13 +16,161 @@ example_files = {
 }
 
 # --- Helper Functions ---
-from main import build_prompt, apply_operator, rank_task, PRIORITY_LABELS
+from main import (
+    classify_panel, normalize_category, panel_scorer, score_tasks, CLASSIFICATION_CACHE_DIR, MAX_WORKERS, BATCH_SIZE,
+    TRAINING_TASKS_PATH, USE_KNN_FAST_PATH, KNN_CONFIDENCE_THRESHOLD, NEAR_DUPLICATE_THRESHOLD, PRIORITY_LABELS,
+)
+import instrumentation
+from knn_classifier import KNNClassifier
+from classification_cache import ClassificationCache
+from rules import RuleValidationError
+from patients import PatientStore
+from scoring import CompiledRules
+from storage import PARQUET, UPLOAD_TYPES, read_table, read_table_bytes, table_bytes
+
+
+# --- Cached loaders and derived artifacts ---
+# Streamlit re-runs this script on every widget interaction, so anything derived from the
+# inputs is cached under a content key: the upload's SHA-256, a default file's path and
+# mtime, or a hash of an edited DataFrame. A changed input gets a new key; nothing else
+# needs invalidating. Cached objects are shared between reruns and treated as read-only.
+
+def frame_fingerprint(df):
+    """Content hash of a DataFrame (values, index and column names)."""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes() + repr(list(df.columns)).encode()).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def load_table_bytes(content_hash, name, _data):
+    return read_table_bytes(_data, name)
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def load_table_file(path, mtime):
+    return read_table(path)
+
+
+def load_table(uploaded_file, default_path):
+    """Load an upload (keyed on its bytes) or the default file (keyed on path + mtime).
+
+    CSV, Parquet and Arrow files are accepted; the format follows the file name.
+    Returns (df, content_key).
+    """
+    if uploaded_file is not None:
+        data = uploaded_file.getvalue()
+        content_hash = hashlib.sha256(data).hexdigest()
+        return load_table_bytes(content_hash, uploaded_file.name, data), content_hash
+    mtime = os.path.getmtime(default_path)
+    return load_table_file(default_path, mtime), f"{default_path}@{mtime}"
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_task_list(freeform_key, event_key, _freeform_tasks, _event_tasks):
+    """Tag and merge the free-form and event-triggered task lists."""
+    freeform_tasks = _freeform_tasks.copy()
+    freeform_tasks["task_source"] = "patient_freeform"
+
+    event_tasks = _event_tasks.copy()
+    event_tasks["task_source"] = "event_triggered"
+    return pd.concat([freeform_tasks, event_tasks], ignore_index=True)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_patient_store(panel_key, _patient_panel_df):
+    return PatientStore(_patient_panel_df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def get_compiled_rules(rules_key, _priority_rules_df):
+    """Compile (and validate) a rules table once per distinct table contents."""
+    return CompiledRules(_priority_rules_df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_knn_classifier(examples_key, _examples):
+    """k-NN index over the labeled examples plus the training tasks, embedded once."""
+    return KNNClassifier.from_frames(_examples, read_table(TRAINING_TASKS_PATH), normalize_label=normalize_category)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def classify_cached(tasks_key, examples_key, max_workers, batch_size, knn_threshold, near_duplicate_threshold,
+                    _tasks_df, _examples):
+    """
+    Categorize a task list once per (tasks, examples, k-NN threshold, near-duplicate threshold) content.
+
+    Returns (classification_df, cache_stats, knn_stats); the on-disk classification
+    cache still spares LLM calls across sessions. knn_threshold=None disables the
+    k-NN fast path; near_duplicate_threshold=None only groups exact duplicates.
+    """
+    knn = None
+    if knn_threshold is not None:
+        # Shallow copy: shares the cached index, but gets its own threshold and counters
+        knn = copy.copy(get_knn_classifier(examples_key, _examples))
+        knn.threshold = knn_threshold
+        knn.fast_path = knn.fallbacks = 0
+
+    cache = ClassificationCache(CLASSIFICATION_CACHE_DIR)
+    classification = classify_panel(
+        _tasks_df, _examples, cache=cache, max_workers=max_workers, knn=knn, batch_size=batch_size,
+        near_duplicate_threshold=near_duplicate_threshold,
+    )
+    cache_stats = cache.stats()
+    cache.close()
+    return classification, cache_stats, knn.stats() if knn is not None else None
+
+
+def highlight_priority(row):
+    if row["Priority Label"] == "Critical":
+        return ['background-color: #ffcccc'] * len(row)
+    elif row["Priority Label"] == "High":
+        return ['background-color: #fff5cc'] * len(row)
+    else:
+        return [''] * len(row)
+
+
+def rule_impact(output_df, match_df):
+    """Per rule: tasks matched, points added, and how many of those tasks landed in each priority label."""
+    match_df = match_df.assign(label=output_df["Priority Label"].reindex(match_df["task"]).to_numpy())
+    summary = match_df.groupby("rule_id").agg(**{
+        "Tasks Matched": ("task", "nunique"),
+        "Points Added": ("points", "sum"),
+    })
+    labels = list(dict.fromkeys(PRIORITY_LABELS.values()))
+    by_label = pd.crosstab(match_df["rule_id"], match_df["label"]).reindex(columns=labels, fill_value=0)
+    return summary.join(by_label).sort_values(labels[:2] + ["Points Added"], ascending=False)
+
+
+def rerank_last_run(priority_rules):
+    """
+    Re-score the last run's categorized tasks against `priority_rules` without calling the LLM.
+
+    Returns (output_df, rules_evaluated, elapsed_ms), or None if the rules don't compile
+    (the validation error is shown in the app).
+    """
+    last_run = st.session_state["last_run"]
+    try:
+        compiled_rules = get_compiled_rules(frame_fingerprint(priority_rules), priority_rules)
+    except RuleValidationError as e:
+        st.error(str(e))
+        return None
+
+    start = time.perf_counter()
+    output_df = score_tasks(last_run["tasks"], last_run["scorer"], compiled_rules)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    output_df = output_df.join(last_run["classification"].drop(columns="Predicted Category"))
+    return output_df, last_run["scorer"].rules_evaluated, elapsed_ms
 
 # --- App UI ---
 # === Sidebar Navigation ===
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Go to", ["🏠 Home", "📝 Edit Priority Rules"])
 
+if st.sidebar.button("🧹 Clear cached data"):
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    st.session_state.pop("last_run", None)
+
 # === Page: Home ===
 if page == "🏠 Home":
     st.title("🧠 Patient Task Prioritization Demo")
@@ -37,22 +190,25 @@ if page == "🏠 Home":
 
     # === Upload CSVs ===
     uploaded_files = {}
+    input_keys = {}
     for label, default_path in example_files.items():
-        uploaded_file = st.sidebar.file_uploader(f"{label} CSV", type=["csv"], key=label)
-        if uploaded_file is not None:
-            uploaded_files[label] = pd.read_csv(uploaded_file)
-        else:
-            uploaded_files[label] = pd.read_csv(default_path)
-    #Load and tag the two task sources
-
-    freeform_tasks = uploaded_files["Panel Action List to Prioritize"].copy()
-    freeform_tasks["task_source"] = "patient_freeform"
+        uploaded_file = st.sidebar.file_uploader(f"{label} CSV", type=UPLOAD_TYPES, key=label)
+        uploaded_files[label], input_keys[label] = load_table(uploaded_file, default_path)
 
-    event_tasks = uploaded_files["Event Triggered Tasks"].copy()
-    event_tasks["task_source"] = "event_triggered"
+    # Load, tag and merge the two task sources into one task list
+    all_tasks = build_task_list(
+        input_keys["Panel Action List to Prioritize"], input_keys["Event Triggered Tasks"],
+        uploaded_files["Panel Action List to Prioritize"], uploaded_files["Event Triggered Tasks"],
+    )
 
-# Merge into one task list
-    all_tasks = pd.concat([freeform_tasks, event_tasks], ignore_index=True)
+    # A previous run only stays valid while its tasks, panel and examples are unchanged
+    run_inputs = (
+        input_keys["Panel Action List to Prioritize"], input_keys["Event Triggered Tasks"],
+        input_keys["Patient Panel"], input_keys["Training Data - Labeled Tasks"],
+    )
+    if st.session_state.get("last_run", {}).get("inputs", run_inputs) != run_inputs:
+        del st.session_state["last_run"]
+        st.info("ℹ️ Uploaded data changed since the last run — run prioritization again to refresh the results.")
 
 
     # === Show Uploaded Data (Preview only, not editable) ===
@@ -69,8 +225,21 @@ if page == "🏠 Home":
     if "edited_priority_rules" in st.session_state:
         st.success("✅ Edited Priority Rules detected — will use them for prioritization!")
 
+    max_workers = st.sidebar.slider("Concurrent LLM requests", min_value=1, max_value=32, value=MAX_WORKERS)
+    batch_size = st.sidebar.slider("Tasks per LLM request", min_value=1, max_value=25, value=BATCH_SIZE)
+    use_knn = st.sidebar.checkbox("k-NN fast path before the LLM", value=USE_KNN_FAST_PATH)
+    knn_threshold = st.sidebar.slider(
+        "k-NN confidence threshold", min_value=0.0, max_value=1.0, value=KNN_CONFIDENCE_THRESHOLD, step=0.05,
+        disabled=not use_knn,
+    )
+    group_near_duplicates = st.sidebar.checkbox("Classify near-duplicate tasks once", value=NEAR_DUPLICATE_THRESHOLD is not None)
+    near_duplicate_threshold = st.sidebar.slider(
+        "Near-duplicate similarity", min_value=0.5, max_value=1.0, value=NEAR_DUPLICATE_THRESHOLD or 0.85, step=0.05,
+        disabled=not group_near_duplicates,
+    )
+
     if st.button("Run Categorization & Prioritization"):
-        with st.spinner("Running..."):
+        with st.spinner("Running..."), instrumentation.collect() as run_stats:
 
             # Load datasets
             patient_panel_df = uploaded_files["Patient Panel"]
@@ -80,57 +249,90 @@ if page == "🏠 Home":
             # 🛠 Use edited rules if available
             priority_rules = st.session_state.get("edited_priority_rules", uploaded_files["Priority Rules"])
 
-            results = []
-
-            for idx, row in all_tasks.iterrows():
-                patient_id = row["patient_id"]
-                patient_name = row["patient_name"]
-                task = row["TASK"]
-                task_source = row["task_source"]
+            patient_store = get_patient_store(input_keys["Patient Panel"], patient_panel_df)
+            unmatched = patient_store.unmatched_tasks(all_tasks)
+            if len(unmatched):
+                st.warning(
+                    f"⚠️ {len(unmatched)} task(s) reference patients that are not in the patient panel. "
+                    "They are scored without patient factors."
+                )
+                st.dataframe(unmatched, use_container_width=True)
+
+            try:
+                # Validate before paying for any LLM calls
+                get_compiled_rules(frame_fingerprint(priority_rules), priority_rules)
+            except RuleValidationError as e:
+                st.error(str(e))
+                st.stop()
+
+            tasks_key = (input_keys["Panel Action List to Prioritize"], input_keys["Event Triggered Tasks"])
+            classification, cache_stats, knn_stats = classify_cached(
+                tasks_key, input_keys["Training Data - Labeled Tasks"], max_workers, batch_size,
+                knn_threshold if use_knn else None, near_duplicate_threshold if group_near_duplicates else None,
+                all_tasks, example_sample
+            )
+            predicted_categories = classification["Predicted Category"].tolist()
+            n_unresolved = int((classification["Classification Source"] == "unresolved").sum())
+            if n_unresolved:
+                # Don't keep this result, so running again asks the LLM about those tasks again
+                classify_cached.clear()
+                st.warning(
+                    f"⚠️ {n_unresolved} task(s) got an LLM answer naming no category; they are ranked without "
+                    f"category points. Run again to retry them."
+                )
 
-                patient_info = patient_panel_df[patient_panel_df["patient_id"] == patient_id].iloc[0]
+            # Keep the categories so rule edits can re-rank without calling the LLM again
+            st.session_state["last_run"] = {
+                "inputs": run_inputs,
+                "tasks": all_tasks,
+                "scorer": panel_scorer(all_tasks, predicted_categories, patient_store),
+                "classification": classification,
+            }
 
-                prompt = build_prompt(example_sample, task)
-                response = ollama.chat(
-                    model="llama3.2",
-                    messages=[{"role": "user", "content": prompt}]
+            st.success("✅ Categorization and prioritization complete!")
+            st.caption(
+                f"Classification cache: {cache_stats['hits']} hits, {cache_stats['misses']} LLM calls · "
+                f"median latency {classification['Classification Latency (s)'].median():.3f}s per task"
+            )
+            dedup_stats = classification.attrs.get("dedup")
+            if dedup_stats:
+                st.caption(
+                    f"Deduplication: {dedup_stats['tasks']} task(s) classified as {dedup_stats['groups']} "
+                    f"distinct ({dedup_stats['dedup_ratio']:.1f}x fewer classifications)"
                 )
-                predicted_category = response["message"]["content"].strip()
-
-                priority_rank, score, point_reasons = rank_task(task, predicted_category, patient_info, priority_rules)
-
-                results.append({
-                    "Patient ID": patient_id,
-                    "Patient Name": patient_name,
-                    "Task": task,
-                    "Task Source": task_source,  # NEW field
-                    "Predicted Category": predicted_category,
-                    "Priority Rank": priority_rank,
-                    "Priority Label": PRIORITY_LABELS[priority_rank],
-                    "Priority Score": score,
-                    "Patient Factors": "\n".join(f"• {reason}" for reason in point_reasons) if point_reasons else ""
-                })
-
-
-            # Build output DataFrame
-            output_df = pd.DataFrame(results)
-            output_df = output_df.sort_values(by=["Priority Rank", "Priority Score"], ascending=[True, False])
-
-            # === Highlight Critical/High Priority Tasks ===
-            def highlight_priority(row):
-                if row["Priority Label"] == "Critical":
-                    return ['background-color: #ffcccc'] * len(row)
-                elif row["Priority Label"] == "High":
-                    return ['background-color: #fff5cc'] * len(row)
-                else:
-                    return [''] * len(row)
-
-            styled_df = output_df.style.apply(highlight_priority, axis=1)
+            if knn_stats is not None:
+                st.caption(
+                    f"k-NN fast path: {knn_stats['fast_path']} task(s) categorized locally, "
+                    f"{knn_stats['llm_fallbacks']} sent to the LLM ({knn_stats['fallback_rate']:.0%} fallback)"
+                )
+        st.session_state["last_run"]["report"] = run_stats.report()
+
+    # === Prioritized Tasks (re-ranked live with the current rules) ===
+    if "last_run" in st.session_state:
+        priority_rules = st.session_state.get("edited_priority_rules", uploaded_files["Priority Rules"])
+        reranked = rerank_last_run(priority_rules)
+        if reranked is not None:
+            output_df, rules_evaluated, elapsed_ms = reranked
+            st.caption(
+                f"Ranked with the current rules in {elapsed_ms:.1f} ms "
+                f"({rules_evaluated} rule(s) re-evaluated, no LLM calls)."
+            )
 
-            st.success("✅ Categorization and prioritization complete!")
+            # Match records are columnar (task, rule_id, match_kind, points), so filtering and
+            # aggregating by rule needs no parsing of the "Patient Factors" text
+            match_df = st.session_state["last_run"]["scorer"].matches.to_frame()
+            rule_filter = st.multiselect("Only show tasks matched by rule(s)", sorted(match_df["rule_id"].unique()))
+            shown_df = output_df
+            if rule_filter:
+                shown_df = output_df[output_df.index.isin(match_df.loc[match_df["rule_id"].isin(rule_filter), "task"])]
 
+            styled_df = shown_df.style.apply(highlight_priority, axis=1)
             st.dataframe(styled_df, use_container_width=True)
 
+            if len(match_df):
+                with st.expander("📊 Rule impact — which rules drive each priority level"):
+                    st.dataframe(rule_impact(output_df, match_df), use_container_width=True)
+
             # === Download Button for Output ===
             csv = output_df.to_csv(index=False).encode('utf-8')
             st.download_button(
@@ -139,6 +341,34 @@ if page == "🏠 Home":
                 file_name="categorized_tasks_with_ranking.csv",
                 mime="text/csv",
             )
+            st.download_button(
+                label="📥 Download as Parquet",
+                data=table_bytes(output_df, PARQUET),
+                file_name="categorized_tasks_with_ranking.parquet",
+                mime="application/vnd.apache.parquet",
+            )
+
+        # === Run Diagnostics ===
+        report = st.session_state["last_run"].get("report")
+        if report is not None:
+            with st.expander("🩺 Run diagnostics"):
+                st.caption(
+                    f"Last run took {report['wall_seconds']:.2f}s. Stage times are summed across "
+                    "classifier threads; a run answered from the app cache makes no LLM calls."
+                )
+                stages_df = pd.DataFrame.from_dict(report["stages"], orient="index")
+                if len(stages_df):
+                    st.dataframe(stages_df.sort_values("seconds", ascending=False), use_container_width=True)
+                st.dataframe(
+                    pd.Series(report["counters"], name="count", dtype="int64").sort_index(),
+                    use_container_width=True,
+                )
+                st.download_button(
+                    label="📥 Download run report",
+                    data=json.dumps(report, indent=2),
+                    file_name="run_report.json",
+                    mime="application/json",
+                )
 
 # === Page: Edit Priority Rules ===
 elif page == "📝 Edit Priority Rules":
@@ -157,7 +387,7 @@ elif page == "📝 Edit Priority Rules":
     """)
 
     # --- Dynamically pulled Patient Fields from Patient Panel ---
-    patient_panel_example = pd.read_csv(example_files["Patient Panel"])
+    patient_panel_example, _ = load_table(None, example_files["Patient Panel"])
     patient_fields = patient_panel_example.columns.tolist()
 
     st.subheader("Example Patient Field Values")
@@ -185,18 +415,30 @@ elif page == "📝 Edit Priority Rules":
     """)
 
 
-    uploaded_priority_rules = st.file_uploader("Upload Priority Rules CSV", type=["csv"], key="priority_rules_upload")
+    uploaded_priority_rules = st.file_uploader("Upload Priority Rules CSV", type=UPLOAD_TYPES, key="priority_rules_upload")
 
-    if uploaded_priority_rules is not None:
-        priority_rules_df = pd.read_csv(uploaded_priority_rules)
-    else:
-        priority_rules_df = pd.read_csv(example_files["Priority Rules"])
+    priority_rules_df, _ = load_table(uploaded_priority_rules, example_files["Priority Rules"])
 
     st.info("✏️ You can edit the rules live below. Changes are kept only during this session.")
 
     # Editable Data Editor
     edited_priority_rules = st.data_editor(priority_rules_df, use_container_width=True, num_rows="dynamic")
 
+    # Validate up front so typos show here rather than after the LLM has run
+    if "last_run" in st.session_state:
+        # === What-if preview: re-rank the last run's tasks with the edited rules (validates too) ===
+        reranked = rerank_last_run(edited_priority_rules)
+        if reranked is not None:
+            output_df, rules_evaluated, elapsed_ms = reranked
+            st.subheader("🔮 Prioritized Tasks with These Rules")
+            st.caption(f"Re-ranked in {elapsed_ms:.1f} ms ({rules_evaluated} changed rule(s) re-evaluated).")
+            st.dataframe(output_df.style.apply(highlight_priority, axis=1), use_container_width=True)
+    else:
+        try:
+            get_compiled_rules(frame_fingerprint(edited_priority_rules), edited_priority_rules)
+        except RuleValidationError as e:
+            st.error(str(e))
+
     # 🛠 Save to session state for use in Home page
     st.session_state["edited_priority_rules"] = edited_priority_rules
 
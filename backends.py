@@ -0,0 +1,248 @@
+"""
+Inference backends for task categorization.
+
+Prompts are handed over as a static `prefix` (intro + few-shot examples, identical for
+every task in a run) and a per-task `suffix`, so a backend that can reuse work across
+requests knows exactly which part is shared.
+
+For classification, label_probabilities() restricts the answer to a fixed set of labels
+and returns a probability for each one instead of free text (or None when the model's
+answer can't be resolved to any label).
+
+- OllamaBackend (default) sends prefix + suffix to an Ollama server over HTTP.
+- LlamaCppBackend runs a local GGUF model in-process with llama_cpp_python. It
+  evaluates the prefix once and keeps it in the KV-cache, rewinding to its end for
+  every task, so per-task work is just the suffix and a few output tokens.
+
+The client libraries (ollama, llama_cpp) are imported on first use, so importing this
+module is cheap.
+"""
+import math
+import os
+import threading
+
+import numpy as np
+
+import instrumentation
+
+DEFAULT_OLLAMA_MODEL = "llama3.2"
+DEFAULT_GGUF_PATH = "models/Llama-3.2-3B-Instruct-Q4_K_M.gguf"
+
+# Llama 3 instruct chat template, split around the user message
+LLAMA3_USER_HEADER = "<|start_header_id|>user<|end_header_id|>\n\n"
+LLAMA3_ASSISTANT_HEADER = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+LABEL_MAX_TOKENS = 8  # enough for the longest label, so prose after it is never generated
+MIN_LABEL_TOKEN_CHARS = 3  # shortest first token taken as the start of a label
+
+
+def match_label(text, labels):
+    """The label `text` names: an exact (case-insensitive) match, else the label mentioned first, else None."""
+    text = str(text).strip().strip("\"'.").lower()
+    by_key = {label.lower(): label for label in labels}
+    if text in by_key:
+        return by_key[text]
+    mentions = [(text.find(key), label) for key, label in by_key.items() if key in text]
+    return min(mentions)[1] if mentions else None
+
+
+def starts_label(token, label):
+    """
+    Whether a generated token is the start of `label`: a prefix of its first word at least
+    MIN_LABEL_TOKEN_CHARS long, so ordinary words ("I", "In", "So") don't count.
+    """
+    token = str(token).strip().lower()
+    return len(token) >= MIN_LABEL_TOKEN_CHARS and label.lower().split()[0].startswith(token)
+
+
+def normalize_log_probs(labels, log_probs):
+    """Softmax of per-label log-probabilities into a {label: probability} dict."""
+    top = max(log_probs)
+    weights = [math.exp(log_prob - top) for log_prob in log_probs]
+    total = sum(weights)
+    return {label: weight / total for label, weight in zip(labels, weights)}
+
+
+class OllamaBackend:
+    """Chat completion through the Ollama HTTP API."""
+
+    name = "ollama"
+
+    def __init__(self, model=DEFAULT_OLLAMA_MODEL):
+        self.model = model
+
+    def generate(self, prefix, suffix, json_output=False, max_tokens=None):
+        options = {"num_predict": max_tokens} if max_tokens else None
+        kwargs = {"format": "json"} if json_output else {}
+        if options:
+            kwargs["options"] = options
+        import ollama
+
+        response = ollama.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": prefix + suffix}],
+            **kwargs,
+        )
+        self._count_tokens(response)
+        return response["message"]["content"]
+
+    @staticmethod
+    def _count_tokens(response):
+        instrumentation.count("prompt_tokens", response.get("prompt_eval_count") or 0)
+        instrumentation.count("output_tokens", response.get("eval_count") or 0)
+
+    def label_probabilities(self, prefix, suffix, labels):
+        """
+        Probability of each label as the answer.
+
+        Generation is greedy and capped at LABEL_MAX_TOKENS. The reply is resolved to a
+        label with match_label. When the server reports top_logprobs and the first
+        generated token begins that label (see starts_label), the labels' first-token
+        log-probabilities give the distribution; otherwise the matched label gets
+        probability 1, as with prose such as "In my view: Clinical Stability". Returns
+        None when the reply names no label, so a garbled reply is never mistaken for a
+        prediction.
+        """
+        import ollama
+
+        response = ollama.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": prefix + suffix}],
+            options={"temperature": 0, "num_predict": LABEL_MAX_TOKENS},
+            logprobs=True,
+            top_logprobs=20,
+        )
+        self._count_tokens(response)
+        answer = match_label(response["message"]["content"], labels)
+        if answer is None:
+            return None
+
+        token_logprobs = response.get("logprobs") or []
+        if token_logprobs and starts_label(token_logprobs[0]["token"], answer):
+            first = token_logprobs[0]
+            candidates = [first] + list(first.get("top_logprobs") or [])
+            log_probs = [
+                max((candidate["logprob"] for candidate in candidates if starts_label(candidate["token"], label)),
+                    default=-math.inf)
+                for label in labels
+            ]
+            return normalize_log_probs(labels, log_probs)
+        return {label: float(label == answer) for label in labels}
+
+
+class LlamaCppBackend:
+    """
+    In-process llama.cpp inference that evaluates the shared prompt prefix once.
+
+    The KV-cache keeps the prefix between calls: each call rewinds the context to the
+    end of the prefix (llama.cpp drops the cache entries past that position on the next
+    eval) and only evaluates the per-task suffix. Nothing is copied in or out of the
+    context, and only the most recent prefix is kept, so a new prefix is evaluated again.
+
+    A llama.cpp context can only run one sequence at a time, so generate() holds a lock;
+    for parallel throughput run one backend per process rather than more threads.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path=DEFAULT_GGUF_PATH, n_ctx=4096, n_threads=None, max_tokens=16,
+                 user_header=LLAMA3_USER_HEADER, assistant_header=LLAMA3_ASSISTANT_HEADER):
+        from llama_cpp import Llama  # optional dependency, only needed for this backend
+
+        self.model = os.path.basename(model_path)
+        self.max_tokens = max_tokens
+        self.user_header = user_header
+        self.assistant_header = assistant_header
+        self._llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        self._end_tokens = {self._llm.token_eos()} | {
+            token for token in self._llm.tokenize(b"<|eot_id|><|end_of_text|>", add_bos=False, special=True)
+        }
+        self._prefix = None  # prompt prefix whose tokens are the first _prefix_length in the context
+        self._prefix_length = 0
+        self._lock = threading.Lock()
+
+    def _rewind_to_prefix(self, prefix):
+        """Leave the context holding exactly BOS + user header + prefix, evaluating it only if it changed."""
+        if prefix != self._prefix:
+            tokens = self._llm.tokenize((self.user_header + prefix).encode("utf-8"), add_bos=True, special=True)
+            self._llm.reset()
+            self._prefix = None  # stays unset if eval fails part-way
+            self._llm.eval(tokens)
+            self._prefix, self._prefix_length = prefix, self._llm.n_tokens
+        self._llm.n_tokens = self._prefix_length
+
+    def _suffix_tokens(self, suffix):
+        tokens = self._llm.tokenize((suffix + self.assistant_header).encode("utf-8"), add_bos=False, special=True)
+        instrumentation.count("prompt_tokens", len(tokens))
+        return tokens
+
+    def generate(self, prefix, suffix, json_output=False, max_tokens=None):
+        max_tokens = max_tokens or self.max_tokens
+        with self._lock:
+            self._rewind_to_prefix(prefix)
+            output = []
+            # Greedy decoding continuing from the prefix (reset=False keeps the cache)
+            for token in self._llm.generate(self._suffix_tokens(suffix), temp=0.0, reset=False):
+                if token in self._end_tokens or len(output) >= max_tokens:
+                    break
+                output.append(token)
+            instrumentation.count("output_tokens", len(output))
+            return self._llm.detokenize(output).decode("utf-8", errors="ignore")
+
+    def _next_token_log_probs(self):
+        import llama_cpp
+
+        logits = llama_cpp.llama_get_logits_ith(self._llm.ctx, -1)
+        return self._llm.logits_to_logprobs(np.ctypeslib.as_array(logits, shape=(self._llm.n_vocab(),)))
+
+    def label_probabilities(self, prefix, suffix, labels):
+        """
+        Probability of each label as the answer, scored from the logits without sampling.
+
+        Each label's log-probability is the sum over its tokens, evaluated after the
+        assistant header (rewinding to that point between labels), then the labels are
+        softmax-normalized.
+        """
+        with self._lock:
+            self._rewind_to_prefix(prefix)
+            self._llm.eval(self._suffix_tokens(suffix))
+            answer_start = self._llm.n_tokens
+            first_token_log_probs = self._next_token_log_probs()
+
+            log_probs = []
+            for label in labels:
+                tokens = self._llm.tokenize(label.encode("utf-8"), add_bos=False)
+                log_prob = float(first_token_log_probs[tokens[0]])
+                self._llm.n_tokens = answer_start
+                for previous, token in zip(tokens, tokens[1:]):
+                    self._llm.eval([previous])
+                    log_prob += float(self._next_token_log_probs()[token])
+                log_probs.append(log_prob)
+            return normalize_log_probs(labels, log_probs)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name, **kwargs):
+    """
+    Shared backend instance by name ("ollama" or "llama_cpp").
+
+    Instances are created on first use with `kwargs` and reused afterwards, so a GGUF
+    model is only loaded once per process.
+    """
+    with _backends_lock:
+        if name not in _backends:
+            if name == "ollama":
+                _backends[name] = OllamaBackend(**kwargs)
+            elif name == "llama_cpp":
+                _backends[name] = LlamaCppBackend(**kwargs)
+            else:
+                raise ValueError(f"Unknown inference backend {name!r} (expected 'ollama' or 'llama_cpp')")
+        return _backends[name]
+
+
+def register_backend(name, backend):
+    """Install `backend` as the shared instance for `name` (e.g. a stub LLM for benchmarks)."""
+    with _backends_lock:
+        _backends[name] = backend
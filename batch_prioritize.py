@@ -0,0 +1,180 @@
+"""
+Prioritize many task files in parallel.
+
+    python batch_prioritize.py "data/unlabeled_tasks*.csv" --workers 4
+    python batch_prioritize.py data/unlabeled_tasks.csv data/unlabeled_tasks_v2.csv --output-dir outputs
+
+Input files are fanned out over a process pool. Each worker process loads the patient
+panel, compiled rules, few-shot examples, k-NN index and inference backend once, then
+ranks whole files. Every input gets its own ranked CSV in --output-dir, and all of them
+are merged into one globally ranked file. Inputs, panel, rules and examples may be CSV,
+Parquet or Arrow files; the ranked outputs are CSV. With the in-process llama.cpp backend
+(--backend llama_cpp) the CPU threads are divided between the workers, so throughput
+scales with cores instead of being bound by one Ollama server.
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+from backends import get_backend
+from checkpoint import TaskCheckpoint, file_sha256, run_id
+from classification_cache import ClassificationCache
+from knn_classifier import KNNClassifier
+from patients import PatientStore
+from scoring import CompiledRules
+from storage import read_table
+from streaming import merge_sorted_runs
+
+DEFAULT_INPUTS = ["data/unlabeled_tasks*.csv"]
+DEFAULT_OUTPUT_DIR = "outputs"
+MERGED_OUTPUT_NAME = "all_tasks_ranked.csv"
+
+# Per-process state, set once by _init_worker
+_worker = {}
+
+
+def expand_inputs(patterns):
+    """Files matching each path or glob pattern, in order, without duplicates."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            raise FileNotFoundError(f"No task files match {pattern!r}")
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def output_path_for(input_path, output_dir):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{stem}_ranked.csv")
+
+
+def _init_worker(config):
+    """Load everything a worker reuses across files: panel, rules, examples, k-NN, backend and cache."""
+    examples = read_table(config["examples_path"])
+    priority_rules_df = read_table(config["rules_path"])
+    compiled_rules = CompiledRules(priority_rules_df)  # fails fast on malformed rules; reused for every file
+
+    if config["backend"] == "llama_cpp":
+        backend = get_backend(
+            "llama_cpp", model_path=config["model_path"], n_threads=config["threads_per_worker"]
+        )
+    else:
+        backend = main.load_backend(config["backend"])
+
+    knn = None
+    if config["use_knn"]:
+        knn = KNNClassifier.from_frames(
+            examples, read_table(main.TRAINING_TASKS_PATH), normalize_label=main.normalize_category,
+            threshold=main.KNN_CONFIDENCE_THRESHOLD,
+        )
+
+    _worker.update(
+        config=config,
+        examples=examples,
+        priority_rules_df=priority_rules_df,
+        compiled_rules=compiled_rules,
+        patient_store=PatientStore(read_table(config["panel_path"])),
+        backend=backend,
+        knn=knn,
+        cache=ClassificationCache(main.CLASSIFICATION_CACHE_DIR),
+        context=main.classification_context(examples, backend),
+    )
+
+
+def _prioritize_file(input_path):
+    """Rank one task file in a worker; returns (input_path, output_path, n_tasks, seconds)."""
+    start = time.perf_counter()
+    config = _worker["config"]
+    tasks_df = read_table(input_path)
+    assert "TASK" in tasks_df.columns, f"Expected 'TASK' column not found in {input_path}."
+    for column in ("patient_id", "patient_name"):
+        if column not in tasks_df.columns:
+            tasks_df[column] = None  # older task files aren't tied to patients; they get task rules only
+
+    checkpoint = TaskCheckpoint(run_id(file_sha256(input_path), _worker["context"]), main.CHECKPOINT_PATH)
+    output_df = main.prioritize_tasks(
+        tasks_df, _worker["patient_store"], _worker["priority_rules_df"], _worker["examples"],
+        cache=_worker["cache"], max_workers=config["llm_concurrency"], knn=_worker["knn"],
+        batch_size=config["batch_size"], backend=_worker["backend"], checkpoint=checkpoint,
+        near_duplicate_threshold=config["near_duplicate_threshold"], compiled_rules=_worker["compiled_rules"],
+    )
+    output_df.insert(0, "Input File", os.path.basename(input_path))
+
+    output_path = output_path_for(input_path, config["output_dir"])
+    output_df.to_csv(output_path, index=False)
+    checkpoint.discard()
+    checkpoint.close()
+    return input_path, output_path, len(output_df), time.perf_counter() - start
+
+
+def run_batch(input_paths, config, workers):
+    """
+    Rank every input file on a pool of `workers` processes and merge the results.
+
+    Returns (per_input_outputs, merged_path, n_tasks) where per_input_outputs maps each
+    input path to its ranked CSV.
+    """
+    os.makedirs(config["output_dir"], exist_ok=True)
+    outputs = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = [pool.submit(_prioritize_file, path) for path in input_paths]
+        for future in as_completed(futures):
+            input_path, output_path, n_tasks, seconds = future.result()
+            outputs[input_path] = output_path
+            print(f"✅ {input_path}: {n_tasks} task(s) ranked in {seconds:.1f}s → {output_path}")
+
+    # Per-input files are already sorted by priority, so the global ranking is a streaming merge
+    merged_path = os.path.join(config["output_dir"], MERGED_OUTPUT_NAME)
+    n_tasks = merge_sorted_runs([outputs[path] for path in input_paths], merged_path, main.priority_sort_key)
+    return outputs, merged_path, n_tasks
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Categorize and rank task files in parallel.")
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_INPUTS, help="task files (CSV, Parquet or Arrow) or glob patterns")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--rules", default=main.PRIORITY_RULES_PATH)
+    parser.add_argument("--panel", default=main.PATIENT_PANEL_PATH)
+    parser.add_argument("--examples", default=main.CURATED_EXAMPLES_PATH)
+    parser.add_argument("--backend", choices=["ollama", "llama_cpp"], default=main.INFERENCE_BACKEND)
+    parser.add_argument("--model-path", default=main.LLAMA_CPP_MODEL_PATH, help="GGUF model for --backend llama_cpp")
+    parser.add_argument("--llm-concurrency", type=int, default=main.MAX_WORKERS,
+                        help="concurrent LLM requests per worker (llama_cpp runs one at a time per worker)")
+    parser.add_argument("--batch-size", type=int, default=main.BATCH_SIZE, help="tasks per LLM request")
+    parser.add_argument("--no-knn", action="store_true", help="send every task to the LLM")
+    parser.add_argument("--near-duplicates", type=float, default=main.NEAR_DUPLICATE_THRESHOLD, metavar="SIMILARITY",
+                        help="also classify tasks at least this similar (0-1) once; default: exact duplicates only")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    input_paths = expand_inputs(args.inputs)
+    workers = max(1, min(args.workers, len(input_paths)))
+    config = {
+        "output_dir": args.output_dir,
+        "rules_path": args.rules,
+        "panel_path": args.panel,
+        "examples_path": args.examples,
+        "backend": args.backend,
+        "model_path": args.model_path,
+        "threads_per_worker": max(1, (os.cpu_count() or 1) // workers),
+        "llm_concurrency": args.llm_concurrency,
+        "batch_size": args.batch_size,
+        "use_knn": not args.no_knn,
+        "near_duplicate_threshold": args.near_duplicates,
+    }
+    print(f"Prioritizing {len(input_paths)} file(s) on {workers} worker process(es)")
+    start = time.perf_counter()
+    _, merged_path, n_tasks = run_batch(input_paths, config, workers)
+    print(f"✅ {n_tasks} task(s) from {len(input_paths)} file(s) ranked in {time.perf_counter() - start:.1f}s. "
+          f"Merged ranking saved to {merged_path}")
+
+
+if __name__ == "__main__":
+    cli()
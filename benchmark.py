@@ -0,0 +1,328 @@
+"""
+Benchmarks for prompt building, rule scoring and the end-to-end prioritization run.
+
+    python benchmark.py --tasks 10000 --rules 100
+    python benchmark.py --tasks 1000000 --rules 1000 --no-memory --compare benchmarks/previous.json
+
+Synthetic patient panels, rules tables and task lists are generated from the schemas
+(and observed values) of the files in data/, at any scale. The LLM is replaced by a
+deterministic stub backend, so runs are repeatable offline and measure this code
+rather than the model. Each stage reports throughput, per-call latency percentiles
+and peak traced memory. Results are written as JSON (with the git commit) so runs
+can be compared across commits with --compare.
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import main
+from backends import register_backend
+from keyword_matcher import KeywordMatcher
+from patients import PatientStore
+from scoring import CompiledRules
+
+DEFAULT_RESULTS_DIR = "benchmarks"
+FIELD_OPERATORS = {"numeric": ["<", ">", "<=", ">=", "=="], "categorical": ["==", "!=", "in"]}
+
+
+# === Stub LLM ===
+class StubBackend:
+    """Deterministic offline stand-in for an inference backend: the label is a hash of the task."""
+
+    model = "benchmark-stub"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def _label(self, text):
+        return main.CATEGORIES[int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16) % len(main.CATEGORIES)]
+
+    def generate(self, prefix, suffix, json_output=False, max_tokens=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if json_output:
+            tasks = [line.split(". ", 1)[1] for line in suffix.splitlines() if line[:1].isdigit() and ". " in line]
+            return json.dumps({str(number): self._label(task) for number, task in enumerate(tasks, start=1)})
+        return self._label(suffix)
+
+    def label_probabilities(self, prefix, suffix, labels):
+        answer = self.generate(prefix, suffix)
+        return {label: float(label == answer) for label in labels}
+
+
+# === Synthetic data ===
+def synthetic_panel(n_patients, rng, panel_template):
+    """Patient panel with the template's columns; each value is drawn from that column's observed values."""
+    panel = {"patient_id": [f"{number:06d}" for number in range(1, n_patients + 1)]}
+    names = panel_template["patient_name"].dropna().tolist()
+    panel["patient_name"] = [f"{names[i % len(names)]} {i}" for i in range(n_patients)]
+    for column in panel_template.columns.drop(["patient_id", "patient_name"]):
+        observed = panel_template[column].dropna()
+        if pd.api.types.is_numeric_dtype(observed):
+            panel[column] = rng.integers(observed.min(), observed.max() + 1, n_patients)
+        else:
+            panel[column] = rng.choice(observed.unique(), n_patients)
+    return pd.DataFrame(panel)
+
+
+def keyword_pool(task_texts):
+    """Candidate rule keywords: the critical keywords plus every longer word of the labeled tasks."""
+    words = sorted({word for text in task_texts for word in str(text).lower().split() if len(word) > 4})
+    return main.CRITICAL_KEYWORDS + words
+
+
+def synthetic_rules(n_rules, rng, panel, task_texts):
+    """Rules table mixing category, keyword, patient-field and conditional rules, like the shipped ones."""
+    fields = [column for column in panel.columns if column not in ("patient_id", "patient_name")]
+    keywords = keyword_pool(task_texts)
+    rows = []
+    for rule_id in range(1, n_rules + 1):
+        row = {"rule_id": rule_id, "task_category": "", "keyword": "", "patient_field": "",
+               "patient_field_operator": "", "patient_field_value": "", "points": int(rng.integers(1, 6)),
+               "condition_field": "", "condition_value": ""}
+        kind = rule_id % 4
+        if kind == 0:
+            row["task_category"] = main.CATEGORIES[int(rng.integers(len(main.CATEGORIES)))]
+        elif kind == 1:
+            row["keyword"] = keywords[int(rng.integers(len(keywords)))]
+        else:
+            field = fields[int(rng.integers(len(fields)))]
+            values = panel[field]
+            numeric = pd.api.types.is_numeric_dtype(values)
+            operator = rng.choice(FIELD_OPERATORS["numeric" if numeric else "categorical"])
+            if operator == "in":
+                value = str(sorted(rng.choice(values.unique(), min(2, values.nunique()), replace=False).tolist()))
+            else:
+                value = str(values.iloc[int(rng.integers(len(values)))])
+            row.update(patient_field=field, patient_field_operator=operator, patient_field_value=value)
+            if kind == 3:
+                condition_field = fields[int(rng.integers(len(fields)))]
+                row["condition_field"] = condition_field
+                row["condition_value"] = str(panel[condition_field].iloc[int(rng.integers(len(panel)))])
+        rows.append(row)
+    return pd.DataFrame(rows).replace("", np.nan)
+
+
+def synthetic_tasks(n_tasks, rng, panel, task_texts, distinct_fraction):
+    """Task list over the panel; about `distinct_fraction` of the tasks are unique variants of known texts."""
+    texts = np.asarray(task_texts, dtype=object)[rng.integers(len(task_texts), size=n_tasks)]
+    variant = rng.random(n_tasks) < distinct_fraction
+    texts[variant] = [f"{text} (case {i})" for i, text in zip(np.flatnonzero(variant), texts[variant])]
+    patients = rng.integers(len(panel), size=n_tasks)
+    return pd.DataFrame({
+        "patient_id": panel["patient_id"].to_numpy()[patients],
+        "patient_name": panel["patient_name"].to_numpy()[patients],
+        "TASK": texts,
+    })
+
+
+# === Measurement ===
+def percentiles(latencies):
+    latencies = np.asarray(latencies, dtype=float)
+    return {f"p{q}_us": round(float(np.percentile(latencies, q)) * 1e6, 2) for q in (50, 95, 99)}
+
+
+def measure(name, func, n_items, track_memory):
+    """
+    Run `func` once (and once more under tracemalloc if `track_memory`); returns a result dict.
+
+    `func` returns per-call latencies in seconds for percentile reporting, or None for a
+    stage that is one big call.
+    """
+    start = time.perf_counter()
+    latencies = func()
+    seconds = time.perf_counter() - start
+    result = {"stage": name, "items": n_items, "seconds": round(seconds, 4),
+              "throughput_per_s": round(n_items / seconds, 1) if seconds else None}
+    if latencies is not None and len(latencies):
+        result.update(percentiles(latencies))
+    if track_memory:
+        tracemalloc.start()
+        func()
+        result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    print(f"{name:<24} {n_items:>9} items  {seconds:8.3f}s  "
+          f"{result['throughput_per_s'] or 0:>12,.0f}/s  p95 {result.get('p95_us', float('nan')):>10} µs"
+          + (f"  peak {result['peak_memory_mb']} MB" if track_memory else ""))
+    return result
+
+
+def timed_calls(calls):
+    """Call each zero-argument function in `calls`, returning per-call latencies in seconds."""
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_benchmarks(args):
+    rng = np.random.default_rng(args.seed)
+    panel_template = pd.read_csv("data/patient_panel.csv")
+    labeled = pd.concat([pd.read_csv(main.CURATED_EXAMPLES_PATH), pd.read_csv(main.TRAINING_TASKS_PATH)])
+    task_texts = labeled["Task"].dropna().tolist()
+    examples = pd.read_csv(main.CURATED_EXAMPLES_PATH)
+
+    panel = synthetic_panel(args.patients, rng, panel_template)
+    rules = synthetic_rules(args.rules, rng, panel, task_texts)
+    tasks = synthetic_tasks(args.tasks, rng, panel, task_texts, args.distinct_fraction)
+    stub = StubBackend(latency=args.llm_latency_ms / 1000)
+    categories = [stub._label(text) for text in tasks["TASK"]]
+    sample = tasks.head(args.sample)
+    results = []
+
+    # Cold start: a fresh interpreter importing main (what a new Streamlit or CLI process pays)
+    import_main = [sys.executable, "-c", "import main"]
+    results.append(measure("import main (cold)", lambda: timed_calls(
+        [lambda: subprocess.run(import_main, check=True)] * args.import_runs
+    ), args.import_runs, False))
+
+    results.append(measure("build_prompt", lambda: timed_calls(
+        [lambda task=task: main.build_prompt(examples, task) for task in sample["TASK"]]
+    ), len(sample), args.memory))
+
+    store = PatientStore(panel)
+    patients = store.join(sample["patient_id"])[0].to_dict("records")
+    field_rules = rules.dropna(subset=["patient_field"]).to_dict("records")
+    operator_calls = [
+        lambda patient=patient, rule=rule: main.apply_operator(
+            patient[rule["patient_field"]], rule["patient_field_operator"], rule["patient_field_value"]
+        )
+        for patient, rule in zip(patients, (field_rules * len(patients))[:len(patients)])
+    ]
+    results.append(measure("apply_operator", lambda: timed_calls(operator_calls), len(operator_calls), args.memory))
+
+    compiled_rules = CompiledRules(rules)
+    results.append(measure("rank_task", lambda: timed_calls([
+        lambda task=task, category=category, patient=patient: main.rank_task(task, category, patient, compiled_rules)
+        for task, category, patient in zip(sample["TASK"], categories, patients)
+    ]), len(sample), args.memory))
+
+    # Every candidate keyword against every distinct task text, as PanelScorer matches them
+    keywords = keyword_pool(task_texts)
+    distinct_texts = tasks["TASK"].str.lower().unique().tolist()
+    results.append(measure("keyword scan (naive)", lambda: timed_calls([
+        lambda text=text: {keyword for keyword in keywords if keyword in text} for text in distinct_texts
+    ]), len(distinct_texts), args.memory))
+    matcher = KeywordMatcher(keywords)
+    results.append(measure("keyword matcher", lambda: timed_calls([
+        lambda text=text: matcher.find(text) for text in distinct_texts
+    ]), len(distinct_texts), args.memory))
+
+    def score_all():
+        main.score_tasks(tasks, main.panel_scorer(tasks, categories, store), compiled_rules)
+    results.append(measure("vectorized scoring", score_all, len(tasks), args.memory))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {name: os.path.join(workdir, f"{name}.csv") for name in ("panel", "rules", "tasks", "output")}
+        panel.to_csv(paths["panel"], index=False)
+        rules.to_csv(paths["rules"], index=False)
+        tasks.to_csv(paths["tasks"], index=False)
+        register_backend(main.INFERENCE_BACKEND, stub)
+        settings = {
+            "PATIENT_PANEL_PATH": paths["panel"], "PRIORITY_RULES_PATH": paths["rules"],
+            "UNLABELED_TASKS_PATH": paths["tasks"], "OUTPUT_PATH": paths["output"],
+            "CLASSIFICATION_CACHE_DIR": os.path.join(workdir, "cache"),
+            "CHECKPOINT_PATH": os.path.join(workdir, "checkpoints.sqlite"),
+            "RUN_REPORT_PATH": os.path.join(workdir, "run_report.json"),
+        }
+        originals = {name: getattr(main, name) for name in settings}
+
+        def end_to_end():
+            # A fresh cache each time, so the run pays for every classification
+            settings["CLASSIFICATION_CACHE_DIR"] = os.path.join(workdir, f"cache-{time.perf_counter_ns()}")
+            for name, value in settings.items():
+                setattr(main, name, value)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main.main()
+            finally:
+                for name, value in originals.items():
+                    setattr(main, name, value)
+        calls_before = stub.calls
+        results.append(measure("main.main() end-to-end", end_to_end, len(tasks), args.memory))
+        results[-1]["llm_calls"] = stub.calls - calls_before
+
+    return results
+
+
+# === Reporting ===
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print each stage's throughput relative to a previous results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["stage"]: result for result in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get(result["stage"], {}).get("throughput_per_s")
+        if before and result["throughput_per_s"]:
+            print(f"{result['stage']:<24} {result['throughput_per_s'] / before:6.2f}× throughput")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark task prioritization with a stub LLM.")
+    parser.add_argument("--tasks", type=int, default=10_000, help="synthetic tasks (1k–1M)")
+    parser.add_argument("--rules", type=int, default=100, help="synthetic rules (10–1000)")
+    parser.add_argument("--patients", type=int, default=2_000)
+    parser.add_argument("--sample", type=int, default=1_000,
+                        help="tasks timed individually for build_prompt, apply_operator and rank_task")
+    parser.add_argument("--distinct-fraction", type=float, default=0.2,
+                        help="share of tasks that are unique variants rather than repeats of known texts")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated delay per stub LLM call")
+    parser.add_argument("--import-runs", type=int, default=3, help="fresh interpreters timed importing main")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the second, tracemalloc-instrumented pass of each stage")
+    parser.add_argument("--output", help=f"results JSON (default: {DEFAULT_RESULTS_DIR}/<timestamp>_<commit>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare throughput against")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    commit = git_commit()
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}_{commit or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,126 @@
+"""
+Durable per-task checkpoints and progress reporting for long prioritization runs.
+
+Every classified task is written to a local SQLite database the moment its result
+arrives, keyed by a run ID (hash of the input file's contents and the classification
+context) and the task's identity (normalized patient ID + task text). A run restarted
+after a crash looks up the tasks it is about to classify and only classifies the rest.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from classification_cache import normalize_task_text
+from patients import normalize_patient_ids
+
+DEFAULT_CHECKPOINT_PATH = ".cache/checkpoints.sqlite"
+LOOKUP_BATCH_SIZE = 500  # task keys per SELECT, below SQLite's bound-parameter limit
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Content hash of a file, read in blocks so large inputs aren't loaded at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_id(input_hash, context):
+    """Checkpoint namespace for one input file classified under one classification context."""
+    return hashlib.sha256(f"{input_hash}:{context}".encode("utf-8")).hexdigest()
+
+
+def task_keys(tasks_df):
+    """Identity of every task row: hash of its normalized patient ID and task text."""
+    patient_ids = normalize_patient_ids(tasks_df["patient_id"])
+    return [
+        hashlib.sha256(f"{patient_id}\x1f{normalize_task_text(task)}".encode("utf-8")).hexdigest()
+        for patient_id, task in zip(patient_ids, tasks_df["TASK"])
+    ]
+
+
+class TaskCheckpoint:
+    """Per-task classification results for one run, stored in SQLite."""
+
+    def __init__(self, run, path=DEFAULT_CHECKPOINT_PATH):
+        self.run = run
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS task_results ("
+            " run TEXT NOT NULL, task_key TEXT NOT NULL,"
+            " category TEXT NOT NULL, source TEXT, confidence REAL, latency REAL,"
+            " PRIMARY KEY (run, task_key))"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def load(self, keys):
+        """
+        {task_key: (category, source, confidence, latency)} for those of `keys` already
+        completed in this run. Only the given keys are read, so a streaming run looking up
+        one chunk at a time never holds the whole run's results.
+        """
+        keys = list(dict.fromkeys(keys))
+        completed = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                rows = self._db.execute(
+                    "SELECT task_key, category, source, confidence, latency FROM task_results"
+                    f" WHERE run = ? AND task_key IN ({', '.join('?' * len(batch))})",
+                    (self.run, *batch),
+                ).fetchall()
+                completed.update((row[0], row[1:]) for row in rows)
+        return completed
+
+    def record(self, results):
+        """Durably store (task_key, category, source, confidence, latency) tuples."""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO task_results VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.run, *result) for result in results],
+            )
+            self._db.commit()
+
+    def discard(self):
+        """Forget this run's results (after its output has been written)."""
+        with self._lock:
+            self._db.execute("DELETE FROM task_results WHERE run = ?", (self.run,))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class ProgressReporter:
+    """Prints done/total, throughput and ETA at most every `interval` seconds, and once at the end."""
+
+    def __init__(self, total, label="Classified", interval=5.0, already_done=0):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = already_done
+        self._resumed = already_done
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def update(self, n=1):
+        self.done += n
+        now = time.perf_counter()
+        if self.done >= self.total or now - self._last_report >= self.interval:
+            self._last_report = now
+            print(self.status(now))
+
+    def status(self, now=None):
+        elapsed = (now or time.perf_counter()) - self._start
+        rate = (self.done - self._resumed) / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "?"
+        percent = self.done / self.total if self.total else 1.0
+        return f"{self.label} {self.done}/{self.total} ({percent:.0%}) — {rate:.1f} tasks/s — ETA {eta}"
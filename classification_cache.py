@@ -0,0 +1,89 @@
+"""
+On-disk cache for task → category predictions.
+
+Keys are content-addressed: the normalized task text plus a fingerprint of
+everything else that shapes the prompt (model name, prompt template and the
+few-shot example set). A cached label is only reused when the LLM would have
+been sent the exact same request.
+"""
+import hashlib
+import json
+import re
+import threading
+
+import diskcache
+
+import instrumentation
+
+DEFAULT_CACHE_DIR = ".cache/classifications"
+DEFAULT_SIZE_LIMIT = 64 * 1024 * 1024   # bytes on disk before least-recently-stored entries are culled
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60     # seconds a prediction stays valid
+
+
+def normalize_task_text(task_text):
+    """Lower-case and collapse whitespace so trivially different task strings share a key."""
+    return re.sub(r"\s+", " ", str(task_text)).strip().lower()
+
+
+def _sha256(payload):
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def examples_fingerprint(examples):
+    """Hash of the few-shot example set (task text and label, in prompt order)."""
+    rows = examples[["Task", "risk_factor_stage"]].astype(str).values.tolist()
+    return _sha256(rows)
+
+
+def context_fingerprint(model, prompt_template, examples):
+    """Hash of the model, prompt template and examples — everything except the task itself."""
+    return _sha256([model, prompt_template, examples_fingerprint(examples)])
+
+
+class ClassificationCache:
+    """
+    Persistent task → category cache with size/age eviction and hit/miss counters.
+
+    Safe to share between classifier threads: diskcache handles concurrent access and
+    the counters are updated under a lock.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, size_limit=DEFAULT_SIZE_LIMIT, max_age=DEFAULT_MAX_AGE):
+        self._cache = diskcache.Cache(directory, size_limit=size_limit)
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, task_text, context):
+        return _sha256([context, normalize_task_text(task_text)])
+
+    def get(self, task_text, context):
+        """Return the cached category, or None on a miss."""
+        category = self._cache.get(self.key(task_text, context))
+        with self._lock:
+            if category is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        instrumentation.count("cache_misses" if category is None else "cache_hits")
+        return category
+
+    def set(self, task_text, context, category):
+        self._cache.set(self.key(task_text, context), category, expire=self.max_age)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._cache),
+            "size_bytes": self._cache.volume(),
+        }
+
+    def clear(self):
+        self._cache.clear()
+
+    def close(self):
+        self._cache.close()
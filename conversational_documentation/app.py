@@ -1,14 +1,19 @@
 import streamlit as st
 import pandas as pd
 import os
-from llm import ask_llm, get_structured_prompt
+from llm import ask_llm, get_structured_prompt, usage_summary
 from example_notes import example_notes
 from patient_data import PATIENTS, PHASE_DISPLAY
 
+@st.cache_data(show_spinner=False)
+def load_structured_fields(csv_path, mtime):
+    """Read structured_fields.csv once per file version instead of on every rerun."""
+    return pd.read_csv(csv_path)
+
 # Load structured rules with error handling
 try:
     csv_path = os.path.join(os.path.dirname(__file__), "structured_fields.csv")
-    rules_df = pd.read_csv(csv_path)
+    rules_df = load_structured_fields(csv_path, os.path.getmtime(csv_path))
 except FileNotFoundError:
     st.error(f"Could not find structured_fields.csv at {csv_path}")
     st.stop()
@@ -87,25 +92,34 @@ with tab1:
         
         submitted = st.form_submit_button("Submit")
 
+    pending_prompt = None
     if submitted and user_input:
         st.session_state.messages = []
         st.session_state.final_note = user_input
         st.session_state.rounds = 0
 
         with st.spinner("helpinghand coach is analyzing your note..."):
-            prompt = get_structured_prompt(user_input, selected_patient)
-            llm_response = ask_llm(prompt)
-
-        st.session_state.messages.append(("helpinghand coach", llm_response))
+            pending_prompt = get_structured_prompt(user_input, selected_patient)
 
     # Show conversation history and take follow-up answers
-    if st.session_state.messages:
+    if st.session_state.messages or pending_prompt is not None:
         st.markdown("---")
         st.subheader("Follow-up Questions")
 
         for i, (role, content) in enumerate(st.session_state.messages):
             st.markdown(f"**{role}:** {content}")
 
+        # Stream the coach's reply into the page as it is written, then keep the full text
+        if pending_prompt is not None:
+            st.markdown("**helpinghand coach:**")
+            llm_response = st.write_stream(ask_llm(
+                pending_prompt, stream=True, on_usage=lambda usage: st.session_state.update(coach_usage=usage)
+            ))
+            st.session_state.messages.append(("helpinghand coach", llm_response))
+
+        if "coach_usage" in st.session_state:
+            st.caption(usage_summary(st.session_state.coach_usage))
+
         if st.session_state.rounds < MAX_ROUNDS and "sufficiently covered" not in st.session_state.messages[-1][1].lower():
             followup_response = st.text_area("Your follow-up response:", key=f"round_{st.session_state.rounds}")
             if st.button("Submit follow-up response"):
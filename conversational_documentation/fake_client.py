@@ -0,0 +1,90 @@
+"""
+Offline stand-in for the Anthropic client, for tests and demos without an API key.
+
+    import llm
+    from fake_client import FakeAnthropicClient
+
+    client = FakeAnthropicClient(reply="All fields are sufficiently covered.")
+    llm.set_client(client)
+
+messages.create() and messages.stream() answer with the canned reply, and usage is
+reported the way the API reports prompt caching: the first request whose system
+prompt ends in a cache_control block writes that prefix to the cache
+(cache_creation_input_tokens); later requests with the same prefix read it
+(cache_read_input_tokens). As with the API, a prefix shorter than
+`min_cacheable_tokens` (MIN_CACHEABLE_TOKENS, Sonnet's minimum, by default) is not
+cached at all. Tokens are estimated at four characters each. Every request is kept
+in `requests` for assertions.
+"""
+import contextlib
+from types import SimpleNamespace
+
+CHARS_PER_TOKEN = 4
+MIN_CACHEABLE_TOKENS = 1024  # shortest prefix the API caches for Sonnet models
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def _text(content):
+    """The text of a message content or system value (a string or a list of blocks)."""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+
+class FakeAnthropicClient:
+    def __init__(self, reply="All fields are sufficiently covered.", min_cacheable_tokens=MIN_CACHEABLE_TOKENS):
+        self.reply = reply
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self.cached_prefixes = set()
+        self.requests = []
+        self.messages = _FakeMessages(self)
+
+    def _cacheable_prefix(self, system):
+        """System text up to and including its last cache_control block, or None."""
+        if not isinstance(system, list):
+            return None
+        marked = [i for i, block in enumerate(system) if block.get("cache_control")]
+        if not marked:
+            return None
+        prefix = _text(system[:marked[-1] + 1])
+        return prefix if estimate_tokens(prefix) >= self.min_cacheable_tokens else None
+
+    def _respond(self, request):
+        self.requests.append(request)
+        system = request.get("system")
+        total = estimate_tokens(_text(system) + "".join(_text(m["content"]) for m in request["messages"]))
+        cache_read = cache_creation = 0
+        prefix = self._cacheable_prefix(system)
+        if prefix is not None:
+            if prefix in self.cached_prefixes:
+                cache_read = estimate_tokens(prefix)
+            else:
+                cache_creation = estimate_tokens(prefix)
+                self.cached_prefixes.add(prefix)
+        usage = SimpleNamespace(
+            input_tokens=total - cache_read - cache_creation,
+            cache_read_input_tokens=cache_read,
+            cache_creation_input_tokens=cache_creation,
+            output_tokens=estimate_tokens(self.reply),
+        )
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=self.reply)], usage=usage)
+
+
+class _FakeMessages:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, **request):
+        return self._client._respond(request)
+
+    @contextlib.contextmanager
+    def stream(self, **request):
+        message = self._client._respond(request)
+        words = message.content[0].text.split(" ")
+        text_stream = (word if i == len(words) - 1 else word + " " for i, word in enumerate(words))
+        yield SimpleNamespace(text_stream=text_stream, get_final_message=lambda: message)
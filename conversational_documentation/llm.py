@@ -1,29 +1,100 @@
 import os
 import pandas as pd
 import streamlit as st
-from anthropic import Anthropic
-from utils import build_structured_followup_prompt
+from utils import StructuredFieldIndex, build_structured_followup_prompt
 
-# Initialize Anthropic client
-client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+STRUCTURED_FIELDS_PATH = os.path.join(os.path.dirname(__file__), "structured_fields.csv")
 
-def ask_llm(prompt_messages):
+# Anthropic client, created on first use by get_client() so importing this module stays cheap
+_client = None
+# ((path, mtime), StructuredFieldIndex) of the last structured-fields table loaded
+_field_index = None
+
+
+def get_client():
+    """Shared Anthropic client (the SDK is imported and the client built on the first call)."""
+    global _client
+    if _client is None:
+        from anthropic import Anthropic
+        _client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    return _client
+
+
+def set_client(client):
+    """Use `client` for every later call, e.g. fake_client.FakeAnthropicClient in tests."""
+    global _client
+    _client = client
+
+
+def get_structured_field_index(csv_path=STRUCTURED_FIELDS_PATH):
+    """The structured-fields index, read from disk once and again only when the CSV changes."""
+    global _field_index
+    version = (csv_path, os.path.getmtime(csv_path))
+    if _field_index is None or _field_index[0] != version:
+        _field_index = (version, StructuredFieldIndex(pd.read_csv(csv_path)))
+    return _field_index[1]
+
+
+def ask_llm(prompt_messages, stream=False, on_usage=None):
+    """
+    Send the messages (system prompt first) to the coach model and return its reply.
+
+    With stream=True the reply is returned as an iterator of text deltas, yielded as
+    the model produces them, so the first words can be shown long before the reply is done.
+
+    The system prompt is marked for prompt caching: it only depends on the patient's
+    profile, so later notes for the same profile read it from the provider's cache
+    instead of paying for it again. (Prefixes below the model's minimum cacheable length,
+    1024 tokens for Sonnet, are not cached.) Once the call completes, `on_usage` (if
+    given) receives its token usage as a dict; see usage_summary().
+    """
     # Extract the system prompt (first message)
     system_prompt = None
     if prompt_messages and prompt_messages[0]["role"] == "system":
-        system_prompt = prompt_messages[0]["content"]
+        system_prompt = [{"type": "text", "text": prompt_messages[0]["content"], "cache_control": {"type": "ephemeral"}}]
         prompt_messages = prompt_messages[1:]
 
-    response = client.messages.create(
+    request = dict(
         model="claude-sonnet-4-20250514",
         max_tokens=500,
         temperature=0.7,
         system=system_prompt,  # Passed here instead of in messages
         messages=prompt_messages,
     )
+    if stream:
+        return _stream_text(request, on_usage)
+
+    response = get_client().messages.create(**request)
+    _report_usage(response.usage, on_usage)
 
     return response.content[0].text
 
+
+def _stream_text(request, on_usage):
+    with get_client().messages.stream(**request) as stream:
+        yield from stream.text_stream
+        _report_usage(stream.get_final_message().usage, on_usage)
+
+
+def _report_usage(usage, on_usage):
+    """Pass one call's token usage (uncached input, cache reads/writes, output) to `on_usage`, if given."""
+    usage = {
+        "input_tokens": usage.input_tokens,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "output_tokens": usage.output_tokens,
+    }
+    if on_usage is not None:
+        on_usage(usage)
+
+
+def usage_summary(usage):
+    return (
+        f"Prompt cache: {usage['cache_read_input_tokens']} tokens read, "
+        f"{usage['cache_creation_input_tokens']} written · {usage['input_tokens']} uncached input tokens, "
+        f"{usage['output_tokens']} output tokens"
+    )
+
 def get_structured_prompt(visit_text, patient):
     """
     Get structured prompt for the LLM based on visit text and patient phase.
@@ -36,9 +107,9 @@ def get_structured_prompt(visit_text, patient):
     - messages (list): List of messages for use with Anthropic chat API.
     """
     # Load structured fields with error handling
+    csv_path = STRUCTURED_FIELDS_PATH
     try:
-        csv_path = os.path.join(os.path.dirname(__file__), "structured_fields.csv")
-        structured_fields_df = pd.read_csv(csv_path)
+        structured_fields = get_structured_field_index(csv_path)
     except FileNotFoundError:
         st.error(f"Could not find structured_fields.csv at {csv_path}")
         return None
@@ -48,7 +119,7 @@ def get_structured_prompt(visit_text, patient):
     
     # Debug: Show the loaded structured fields
     # st.write("Debug - Loaded Structured Fields:")
-    # st.write(structured_fields_df)
+    # st.write(structured_fields.structured_fields_df)
     
     # Debug: Show what we're sending to the LLM
     # st.write("Debug - LLM Input:")
@@ -56,7 +127,7 @@ def get_structured_prompt(visit_text, patient):
     # st.write(f"Patient Info: {patient}")
     
     # Build the prompt
-    messages = build_structured_followup_prompt(visit_text, structured_fields_df, patient)
+    messages = build_structured_followup_prompt(visit_text, structured_fields, patient)
     
     # Debug: Show the full prompt
     # st.write("Debug - Full LLM Prompt:")
@@ -78,7 +149,7 @@ def get_llm_response(messages):
     - str: LLM response.
     """
     try:
-        response = client.messages.create(
+        response = get_client().messages.create(
             model="claude-3-sonnet-20240229",
             max_tokens=1000,
             messages=messages
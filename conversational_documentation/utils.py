@@ -1,88 +1,108 @@
-import pandas as pd
 import streamlit as st
 
-def build_structured_followup_prompt(visit_text, structured_fields_df, patient):
+SYSTEM_INSTRUCTION = (
+    "You are a documentation assistant helping a peer recovery specialist review their visit note. "
+    "You have a list of required fields for this patient phase. "
+    "For each field, only consider it answered if it is clearly and directly addressed in the note. "
+    "Do not infer, assume, or guess. "
+    "Do not introduce any fields or topics that are not in the provided list. "
+    "For each missing field, provide feedback in a warm, encouraging, and collegial tone: "
+    "1) Briefly explain in plain language what is missing, and "
+    "2) Ask a single, specific follow-up question that would help complete that field. "
+    "If all required fields are clearly addressed, say: 'All fields are sufficiently covered.' "
+    "Never list or mention the field names or instructions in your output."
+)
+
+
+class StructuredFieldIndex:
+    """
+    The structured-fields table indexed by (criteria_type, normalized criteria_value).
+
+    Built once per table; resolving a patient's fields is then a few dict lookups, and
+    the rendered field context is memoized per patient profile (phase, diagnosis, flags).
+    """
+
+    def __init__(self, structured_fields_df):
+        self.structured_fields_df = structured_fields_df
+        self._by_criteria = {}
+        rows = structured_fields_df[["criteria_type", "criteria_value", "field_name", "instructions"]]
+        for position, (criteria_type, criteria_value, field_name, instructions) in enumerate(rows.itertuples(index=False)):
+            if isinstance(criteria_value, str):
+                key = (criteria_type, normalize_criteria_value(criteria_value))
+                self._by_criteria.setdefault(key, []).append((position, field_name, instructions))
+        self._contexts = {}
+
+    def _lookup(self, criteria_type, values):
+        """Rows matching any of `values` for one criteria type, in table order."""
+        rows = {}
+        for value in values:
+            for row in self._by_criteria.get((criteria_type, normalize_criteria_value(value)), ()):
+                rows[row[0]] = row
+        return [rows[position] for position in sorted(rows)]
+
+    def relevant_fields(self, patient):
+        """(field_name, instructions) for the patient's phase (plus "all"), diagnosis and flags."""
+        rows = (
+            self._lookup("engagement_phase", [patient["engagement_phase"], "all"])
+            + self._lookup("primary_diagnosis", [patient["primary_diagnosis"]])
+            + self._lookup("flag", patient["flags"])
+        )
+        return [(field_name, instructions) for _, field_name, instructions in rows]
+
+    def field_context(self, patient):
+        """The "- field: instructions" lines for the patient, rendered once per profile."""
+        profile = (
+            normalize_criteria_value(patient["engagement_phase"]),
+            normalize_criteria_value(patient["primary_diagnosis"]),
+            frozenset(normalize_criteria_value(flag) for flag in patient["flags"]),
+        )
+        if profile not in self._contexts:
+            self._contexts[profile] = "\n".join(
+                f"- {field_name}: {instructions}" for field_name, instructions in self.relevant_fields(patient)
+            )
+        return self._contexts[profile]
+
+
+def normalize_criteria_value(value):
+    return str(value).strip().lower()
+
+
+def build_structured_followup_prompt(visit_text, structured_fields, patient):
     """
     Builds a prompt for the LLM based on visit text and patient-specific structured fields.
     
     Parameters:
     - visit_text (str): Free-text note from the care team.
-    - structured_fields_df (pd.DataFrame): DataFrame of structured questions.
+    - structured_fields (StructuredFieldIndex or pd.DataFrame): Index of the structured questions
+      (a DataFrame is indexed on the spot; keep an index around to reuse it across calls).
     - patient (dict): Dictionary containing patient information including engagement_phase, diagnosis, and flags.
     
     Returns:
-    - messages (list): List of messages for use with Anthropic chat API.
+    - messages (list): List of messages for use with Anthropic chat API. The system message
+      (instructions and the patient's required fields) only depends on the patient profile;
+      the user message carries the visit text.
     """
-    phase = patient["engagement_phase"]
-    diagnosis = patient["primary_diagnosis"]
-    flags = patient["flags"]
+    if not isinstance(structured_fields, StructuredFieldIndex):
+        structured_fields = StructuredFieldIndex(structured_fields)
 
     # Debug: Show what we're filtering on
     # st.write("Debug - Patient Criteria:")
-    # st.write(f"- Phase: {phase}")
-    # st.write(f"- Diagnosis: {diagnosis}")
-    # st.write(f"- Active Flags: {flags}")
-
-    # Debug: Show all unique values in the DataFrame
-    # st.write("Debug - Unique values in structured_fields_df:")
-    # st.write("Criteria types:", structured_fields_df["criteria_type"].unique())
-    # st.write("Criteria values:", structured_fields_df["criteria_value"].unique())
-
-    # Filter structured fields
-    phase_fields = structured_fields_df[
-        (structured_fields_df["criteria_type"] == "engagement_phase") & 
-        ((structured_fields_df["criteria_value"].str.lower() == phase.lower()) | 
-         (structured_fields_df["criteria_value"] == "all"))
-    ]
-    
-    diagnosis_fields = structured_fields_df[
-        (structured_fields_df["criteria_type"] == "primary_diagnosis") & 
-        (structured_fields_df["criteria_value"].str.lower() == diagnosis.lower())
-    ]
-    
-    flag_fields = structured_fields_df[
-        (structured_fields_df["criteria_type"] == "flag") & 
-        (structured_fields_df["criteria_value"].isin(flags))
-    ]
-
-    # Debug: Show what fields we found
-    # st.write("Debug - Fields Found:")
-    # st.write("Phase-specific fields:")
-    # st.write(phase_fields[["field_name", "criteria_value", "instructions"]])
-    # st.write("Diagnosis-specific fields:")
-    # st.write(diagnosis_fields[["field_name", "criteria_value", "instructions"]])
-    # st.write("Flag-specific fields:")
-    # st.write(flag_fields[["field_name", "criteria_value", "instructions"]])
-
-    # Combine all relevant fields
-    relevant_fields = pd.concat([phase_fields, diagnosis_fields, flag_fields])
-
-    # Debug: Show final combined fields
-    # st.write("Debug - Final Combined Fields:")
-    # st.write(relevant_fields[["field_name", "criteria_type", "criteria_value", "instructions"]])
+    # st.write(f"- Phase: {patient['engagement_phase']}")
+    # st.write(f"- Diagnosis: {patient['primary_diagnosis']}")
+    # st.write(f"- Active Flags: {patient['flags']}")
 
     # Prepare a hidden context for the LLM: field names and instructions (not to be output)
-    field_context = "\n".join([
-        f"- {row['field_name']}: {row['instructions']}"
-        for _, row in relevant_fields.iterrows()
-    ])
-
-    system_instruction = (
-        "You are a documentation assistant helping a peer recovery specialist review their visit note. "
-        "You have a list of required fields for this patient phase. "
-        "For each field, only consider it answered if it is clearly and directly addressed in the note. "
-        "Do not infer, assume, or guess. "
-        "Do not introduce any fields or topics that are not in the provided list. "
-        "For each missing field, provide feedback in a warm, encouraging, and collegial tone: "
-        "1) Briefly explain in plain language what is missing, and "
-        "2) Ask a single, specific follow-up question that would help complete that field. "
-        "If all required fields are clearly addressed, say: 'All fields are sufficiently covered.' "
-        "Never list or mention the field names or instructions in your output."
+    field_context = structured_fields.field_context(patient)
+
+    # Everything but the visit note is the same for every patient with this profile, so it
+    # goes in the system prompt: a stable prefix the provider can cache (see llm.ask_llm)
+    system_prompt = (
+        f"{SYSTEM_INSTRUCTION}\n\n"
+        f"Required fields for this phase (for your reference, do not output):\n{field_context}"
     )
 
     user_prompt = (
         f"Here is the visit summary to review:\n\"\"\"\n{visit_text}\n\"\"\"\n\n"
-        f"Required fields for this phase (for your reference, do not output):\n{field_context}\n\n"
         f"Please check only the required fields for this phase. "
         f"For each missing field, give a brief, plain-language explanation and a single, specific follow-up question. "
         f"Keep your feedback warm and supportive, like a helpful colleague. "
@@ -90,6 +110,6 @@ def build_structured_followup_prompt(visit_text, structured_fields_df, patient):
     )
 
     return [
-        {"role": "system", "content": system_instruction},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
-    ]
\ No newline at end of file
+    ]
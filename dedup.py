@@ -0,0 +1,117 @@
+"""
+Grouping of duplicate and near-duplicate tasks, so each group is classified once.
+
+Panels repeat the same task text for many patients ("Initial Clinical Visit"), and a
+task's category depends only on its text. TaskGroups puts tasks with the same
+normalized text (classification_cache.normalize_task_text) in one group; with a
+`near_duplicate_threshold` it also merges texts whose character-trigram sets have at
+least that Jaccard similarity ("Schedule PCP visit" / "Schedule PCP visits").
+
+Near-duplicates are found with MinHash signatures and LSH banding, so candidates come
+from shared buckets instead of comparing every pair of texts. Every candidate is
+confirmed with the exact Jaccard similarity against the group's leader (its first
+text); texts are never chained through intermediate matches.
+"""
+import zlib
+
+import numpy as np
+
+from classification_cache import normalize_task_text
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16  # NUM_PERMUTATIONS / LSH_BANDS rows per band
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20250425)
+_PERMUTATION_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.int64)
+_PERMUTATION_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.int64)
+
+
+def shingles(text):
+    """Character trigrams of the text (the whole text when it is shorter)."""
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(left, right):
+    return len(left & right) / len(left | right) if left or right else 1.0
+
+
+def minhash(shingle_set):
+    """MinHash signature (NUM_PERMUTATIONS values) of a set of shingles."""
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingle_set], dtype=np.int64)
+    return ((_PERMUTATION_A[:, None] * hashes[None, :] + _PERMUTATION_B[:, None]) % _PRIME).min(axis=1)
+
+
+class TaskGroups:
+    """
+    Tasks grouped for classification.
+
+    `group` holds each task's group number and `representatives` the position of each
+    group's first task, so a caller classifies tasks[representatives] and fans the
+    labels back out with labels[group].
+    """
+
+    def __init__(self, tasks, near_duplicate_threshold=None):
+        self.n_tasks = len(tasks)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        group_of_text = {}
+        self.representatives = []
+        self.group = np.empty(self.n_tasks, dtype=np.int64)
+        leaders = _NearDuplicateIndex(near_duplicate_threshold) if near_duplicate_threshold else None
+        for position, task in enumerate(tasks):
+            text = normalize_task_text(task)
+            if text not in group_of_text:
+                group = len(self.representatives)
+                if leaders is not None:
+                    group = leaders.assign(text, group)
+                if group == len(self.representatives):
+                    self.representatives.append(position)
+                group_of_text[text] = group
+            self.group[position] = group_of_text[text]
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def members(self):
+        """Task positions of every group, in group order."""
+        order = np.argsort(self.group, kind="stable")
+        return np.split(order, np.flatnonzero(np.diff(self.group[order])) + 1) if self.n_tasks else []
+
+    def stats(self):
+        return {
+            "tasks": self.n_tasks,
+            "groups": len(self),
+            "dedup_ratio": self.n_tasks / len(self) if len(self) else 1.0,
+        }
+
+
+class _NearDuplicateIndex:
+    """LSH buckets over group leaders' MinHash signatures."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.rows = NUM_PERMUTATIONS // LSH_BANDS
+        self.buckets = {}
+        self.leader_shingles = {}
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(LSH_BANDS)]
+
+    def assign(self, text, new_group):
+        """
+        The group of the most similar leader at or above the threshold; otherwise `text`
+        becomes the leader of `new_group`, which is returned.
+        """
+        text_shingles = shingles(text)
+        band_keys = self._band_keys(minhash(text_shingles))
+        candidates = {group for key in band_keys for group in self.buckets.get(key, ())}
+        scored = [(jaccard(text_shingles, self.leader_shingles[group]), -group) for group in candidates]
+        best = max(scored, default=None)
+        if best is not None and best[0] >= self.threshold:
+            return -best[1]
+        self.leader_shingles[new_group] = text_shingles
+        for key in band_keys:
+            self.buckets.setdefault(key, []).append(new_group)
+        return new_group
@@ -0,0 +1,55 @@
+"""
+Find every keyword from a large set in a text with a single scan.
+
+The keywords are compiled into an Aho–Corasick automaton (pyahocorasick), which walks
+the lower-cased text once and reports every keyword occurrence, overlapping ones
+included, in time linear in the text length plus the number of matches — independent
+of how many keywords there are. The result is the same set that testing
+`keyword in text` for each keyword would give; benchmark.py's "keyword matcher" stage
+measures it against that naive scan.
+"""
+import ahocorasick
+
+
+class KeywordMatcher:
+    """
+    Case-insensitive matcher for a fixed set of keywords.
+
+    With `whole_words=True` a keyword only matches between word boundaries
+    ("plan" no longer matches "planning"); the default is plain substring matching,
+    the semantics of the priority rules' keyword column.
+    """
+
+    def __init__(self, keywords, whole_words=False):
+        self.keywords = sorted({keyword.lower() for keyword in keywords if keyword}, key=lambda k: (-len(k), k))
+        self.whole_words = whole_words
+        self._automaton = None
+        if self.keywords:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+
+    def find(self, text):
+        """The set of keywords (lower-cased) occurring in `text`."""
+        if self._automaton is None or not isinstance(text, str):
+            return set()
+        text = text.lower()
+        if not self.whole_words:
+            return {keyword for _, keyword in self._automaton.iter(text)}
+        # iter() reports the index of each occurrence's last character
+        return {
+            keyword for end, keyword in self._automaton.iter(text)
+            if _is_boundary(text, end + 1 - len(keyword)) and _is_boundary(text, end + 1)
+        }
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def _is_boundary(text, position):
+    """Whether `position` is a word boundary (regex \\b) in `text`."""
+    before = position > 0 and _is_word_char(text[position - 1])
+    after = position < len(text) and _is_word_char(text[position])
+    return before != after
@@ -0,0 +1,147 @@
+"""
+Nearest-neighbour fast path for task categorization.
+
+The labeled tasks (curated examples plus the training set) are embedded once into a
+normalized float32 matrix. A new task is assigned the similarity-weighted majority
+label of its k nearest neighbours; only tasks whose vote confidence falls below the
+threshold are sent to the LLM.
+
+HashingEmbedder is a dependency-free stand-in that works offline (hashed word and
+word-bigram TF-IDF); OllamaEmbedder uses a local Ollama embedding model instead.
+"""
+import re
+import threading
+import zlib
+
+import numpy as np
+
+DEFAULT_K = 5
+DEFAULT_CONFIDENCE_THRESHOLD = 0.5
+
+# Words that appear in nearly every task and say nothing about its category
+STOP_WORDS = {
+    "a", "an", "and", "the", "to", "for", "of", "in", "on", "with", "about", "from", "by",
+    "patient", "patients", "patient's", "help", "assist", "support",
+}
+
+
+def _tokens(text):
+    words = [word for word in re.findall(r"[a-z0-9']+", str(text).lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbedder:
+    """Offline TF-IDF embedding over hashed word and word-bigram features."""
+
+    def __init__(self, dim=2048):
+        self.dim = dim
+        self.idf = np.ones(dim, dtype=np.float32)
+
+    def _bucket(self, token):
+        return zlib.crc32(token.encode("utf-8")) % self.dim
+
+    def fit(self, texts):
+        """Learn IDF weights from the labeled corpus. Returns self."""
+        document_frequency = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            document_frequency[list({self._bucket(token) for token in _tokens(text)})] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+        return self
+
+    def __call__(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in _tokens(text):
+                matrix[row, self._bucket(token)] += 1
+        return _normalize_rows(np.log1p(matrix) * self.idf)
+
+
+class OllamaEmbedder:
+    """Embeddings from a local Ollama embedding model (e.g. nomic-embed-text)."""
+
+    def __init__(self, model="nomic-embed-text"):
+        self.model = model
+
+    def fit(self, texts):
+        return self
+
+    def __call__(self, texts):
+        import ollama
+
+        response = ollama.embed(model=self.model, input=list(texts))
+        return _normalize_rows(np.asarray(response["embeddings"], dtype=np.float32))
+
+
+class KNNClassifier:
+    """
+    k-NN vote over embedded labeled tasks, with fast-path/fallback counters.
+
+    Confidence is the winning label's share of the neighbours' similarity mass times
+    the nearest neighbour's similarity, so it is only high when the closest examples
+    are both near-identical to the task and in agreement.
+    """
+
+    def __init__(self, texts, labels, embedder=None, k=DEFAULT_K, threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+        self.embedder = embedder if embedder is not None else HashingEmbedder().fit(texts)
+        self.labels, label_codes = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+        self._label_codes = label_codes
+        self._vectors = self.embedder(list(texts))
+        self.k = min(k, len(self._label_codes))
+        self.threshold = threshold
+        self.fast_path = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frames(cls, *labeled_dfs, normalize_label=None, **kwargs):
+        """
+        Build from DataFrames with "Task" and "risk_factor_stage" columns; duplicate tasks are kept once.
+
+        `normalize_label` (e.g. main.normalize_category) maps each label to its canonical
+        spelling, or to None to leave the row out, so every prediction is a known label.
+        Without it labels are only stripped of surrounding whitespace.
+        """
+        texts, labels, seen = [], [], set()
+        for df in labeled_dfs:
+            for text, label in zip(df["Task"], df["risk_factor_stage"]):
+                label = normalize_label(label) if normalize_label is not None else str(label).strip()
+                key = str(text).strip().lower()
+                if label is not None and key not in seen:
+                    seen.add(key)
+                    texts.append(text)
+                    labels.append(label)
+        return cls(texts, labels, **kwargs)
+
+    def predict(self, texts):
+        """Return (labels, confidences) for a batch of task texts."""
+        if not len(texts):
+            return [], np.zeros(0, dtype=np.float32)
+        similarities = self.embedder(list(texts)) @ self._vectors.T
+        neighbours = np.argpartition(-similarities, self.k - 1, axis=1)[:, :self.k]
+        weights = np.clip(np.take_along_axis(similarities, neighbours, axis=1), 0, None)
+
+        votes = np.zeros((len(texts), len(self.labels)), dtype=np.float32)
+        np.add.at(votes, (np.arange(len(texts))[:, None], self._label_codes[neighbours]), weights)
+        winners = votes.argmax(axis=1)
+        share = votes[np.arange(len(texts)), winners] / np.maximum(votes.sum(axis=1), 1e-9)
+        confidences = share * weights.max(axis=1)
+        return list(self.labels[winners]), confidences
+
+    def record(self, n_fast_path, n_fallbacks):
+        with self._lock:
+            self.fast_path += n_fast_path
+            self.fallbacks += n_fallbacks
+
+    def stats(self):
+        total = self.fast_path + self.fallbacks
+        return {
+            "fast_path": self.fast_path,
+            "llm_fallbacks": self.fallbacks,
+            "fallback_rate": self.fallbacks / total if total else 0.0,
+        }
@@ -1,24 +1,72 @@
 # Imports
+import contextvars
+import functools
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
-import ollama
+import instrumentation
+from backends import get_backend
+from checkpoint import ProgressReporter, TaskCheckpoint, file_sha256, run_id, task_keys
+from classification_cache import ClassificationCache, context_fingerprint, examples_fingerprint
+from dedup import TaskGroups
+from knn_classifier import KNNClassifier
+from rules import compile_predicate
+from patients import PatientStore
+from scoring import CompiledRules, PanelScorer
+from storage import CSV, iter_table_chunks, read_table, table_format, write_table
+from streaming import ChunkRunStore, file_fingerprint, frame_digest, merge_sorted_runs
 
 # === Constants ===
-TRAINING_TASKS_PATH = "data/training_tasks.csv"  # (only used if needed)
+TRAINING_TASKS_PATH = "data/training_tasks.csv"  # k-NN fast-path neighbours (with the curated examples)
 CURATED_EXAMPLES_PATH = "data/curated_examples.csv"
 UNLABELED_TASKS_PATH = "data/unlabeled_tasks_2025-04-25.csv"
 OUTPUT_PATH = "categorized_tasks_with_ranking.csv"
 PATIENT_PANEL_PATH = "data/patient_panel.csv"
 PRIORITY_RULES_PATH = "data/priority_rules_updated.csv"
-patient_panel_df = pd.read_csv(PATIENT_PANEL_PATH)
-priority_rules = pd.read_csv(PRIORITY_RULES_PATH)
-
-required_columns = ['rule_id', 'task_category', 'keyword', 'patient_field', 'patient_field_operator', 'patient_field_value', 'points']
-for col in required_columns:
-    assert col in priority_rules.columns, f"Missing expected column: {col}"
-
+CLASSIFICATION_CACHE_DIR = ".cache/classifications"
+MODEL_NAME = "llama3.2"  # Ollama model
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "ollama")  # or "llama_cpp" for in-process GGUF inference
+LLAMA_CPP_MODEL_PATH = os.getenv("LLAMA_CPP_MODEL_PATH", "models/Llama-3.2-3B-Instruct-Q4_K_M.gguf")
+MAX_WORKERS = 8  # concurrent LLM requests
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+TRANSIENT_LLM_ERRORS = (ConnectionError, TimeoutError)  # plus httpx timeouts, see is_transient_llm_error()
+RETRYABLE_STATUS_CODES = {429}  # plus every 5xx; other ollama.ResponseError codes (missing model, bad request) are permanent
+USE_KNN_FAST_PATH = True
+KNN_CONFIDENCE_THRESHOLD = 0.5  # below this the LLM decides
+NEAR_DUPLICATE_THRESHOLD = None  # e.g. 0.85 also classifies near-identical tasks once; None: exact duplicates only
+BATCH_SIZE = 1  # tasks per LLM request; >1 packs numbered tasks into one prompt with a JSON answer
+BATCH_TOKENS_PER_TASK = 16  # output budget per task in a batched JSON answer
+STREAM_CHUNK_SIZE = 0  # >0 streams the task file in chunks of this many tasks (bounded memory, resumable)
+STREAM_SPILL_DIR = ".cache/stream_runs"  # sorted per-chunk results of an in-progress streaming run
+CHECKPOINT_PATH = ".cache/checkpoints.sqlite"  # per-task results of interrupted runs, so a restart resumes
+RUN_REPORT_PATH = "run_report.json"  # per-stage timings and counters of the last run; None disables instrumentation
+
+
+# The default panel and rules tables, loaded on first access (not at import) by __getattr__
+LAZY_TABLES = {"patient_panel_df": PATIENT_PANEL_PATH, "priority_rules": PRIORITY_RULES_PATH}
+
+
+def __getattr__(name):
+    if name in LAZY_TABLES:
+        globals()[name] = read_table(LAZY_TABLES[name])
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 CRITICAL_KEYWORDS = ["safety plan", "relapse", "warning signs", "crisis"]
+CATEGORIES = [
+    "Individual Agency",
+    "Social Stability",
+    "Clinical Stability",
+    "External Clinicians",
+    "Medication Adherence",
+]
 PRIORITY_LABELS = {
     1: "Critical",
     2: "High",
@@ -27,165 +75,603 @@ PRIORITY_LABELS = {
     5: "Low"
 }
 
-# === Helper Functions ===
-def build_prompt(examples, new_task):
-    intro = (
-        "You are a manager of social workers at a value-based-care company that treats patients with severe mental illnesses who use Medicaid or Medicare for insurance. You need to classify tasks for patient care into one of the following categories:\n"
-        "- Individual Agency\n"
-        "- Social Stability\n"
-        "- Clinical Stability\n"
-        "- External Clinicians\n"
-        "- Medication Adherence\n\n"
-        "Tasks involving clinical symptom tracking, safety planning, early warning signs of relapse, or psychiatric stabilization should be categorized under Clinical Stability. "
-        "Tasks that involve legal, financial, housing, or insurance support should be categorized under Social Stability — even if they involve patient empowerment.\n"
-        "Here are some example tasks and their categories:\n"
-    )
+PROMPT_INTRO = (
+    "You are a manager of social workers at a value-based-care company that treats patients with severe mental illnesses who use Medicaid or Medicare for insurance. You need to classify tasks for patient care into one of the following categories:\n"
+    "- Individual Agency\n"
+    "- Social Stability\n"
+    "- Clinical Stability\n"
+    "- External Clinicians\n"
+    "- Medication Adherence\n\n"
+    "Tasks involving clinical symptom tracking, safety planning, early warning signs of relapse, or psychiatric stabilization should be categorized under Clinical Stability. "
+    "Tasks that involve legal, financial, housing, or insurance support should be categorized under Social Stability — even if they involve patient empowerment.\n"
+    "Here are some example tasks and their categories:\n"
+)
+TASK_PROMPT_TEMPLATE = "\n\nNow categorize the following task:\n\"{task}\"\n\nRespond with only the category name."
+BATCH_PROMPT_TEMPLATE = (
+    "\n\nNow categorize each of the following {count} tasks:\n{numbered_tasks}\n\n"
+    "Respond with only a JSON object that maps every task number to its category name, "
+    "for example {{\"1\": \"Social Stability\", \"2\": \"Clinical Stability\"}}."
+)
 
-    formatted_examples = "\n".join([
+# === Helper Functions ===
+def format_examples(examples):
+    return "\n".join([
         f"- \"{row['Task']}\" → {row['risk_factor_stage']}"
         for _, row in examples.iterrows()
     ])
 
-    task_to_label = f"\n\nNow categorize the following task:\n\"{new_task}\"\n\nRespond with only the category name."
-    return intro + formatted_examples + task_to_label
+
+def build_prompt_parts(examples, new_task):
+    """(static prefix, per-task suffix) of the classification prompt; the prefix is shared by every task."""
+    return PROMPT_INTRO + format_examples(examples), TASK_PROMPT_TEMPLATE.format(task=new_task)
+
+
+def build_prompt(examples, new_task):
+    return "".join(build_prompt_parts(examples, new_task))
+
+
+def build_batch_prompt_parts(examples, tasks):
+    """(static prefix, suffix) of a prompt asking for several numbered tasks' categories as one JSON object."""
+    numbered_tasks = "\n".join(f"{number}. \"{task}\"" for number, task in enumerate(tasks, start=1))
+    tasks_to_label = BATCH_PROMPT_TEMPLATE.format(count=len(tasks), numbered_tasks=numbered_tasks)
+    return PROMPT_INTRO + format_examples(examples), tasks_to_label
+
+
+def load_backend(name=None):
+    """The configured inference backend (INFERENCE_BACKEND by default), created once per process."""
+    name = name or INFERENCE_BACKEND
+    if name == "llama_cpp":
+        return get_backend(name, model_path=LLAMA_CPP_MODEL_PATH)
+    return get_backend(name, model=MODEL_NAME)
+
+
+_CATEGORY_KEYS = {category.lower(): category for category in CATEGORIES}
+
+
+def normalize_category(text):
+    """The canonical CATEGORIES label `text` names (ignoring case, quotes and punctuation), or None."""
+    key = " ".join(re.sub(r"[^a-z ]", " ", str(text).lower()).split())
+    return _CATEGORY_KEYS.get(key)
+
+
+def parse_batch_response(content, count):
+    """
+    Read the model's JSON answer to a batch prompt.
+
+    Returns a list of `count` canonical categories, with None for every item that is
+    missing or not one of CATEGORIES. A JSON list is accepted in place of an object.
+    """
+    try:
+        answer = json.loads(content)
+    except json.JSONDecodeError:
+        embedded = re.search(r"\{.*\}", content, re.DOTALL)
+        try:
+            answer = json.loads(embedded.group(0)) if embedded else None
+        except json.JSONDecodeError:
+            answer = None
+    if isinstance(answer, list):
+        answer = {str(number): item for number, item in enumerate(answer, start=1)}
+    if not isinstance(answer, dict):
+        return [None] * count
+    answer = {str(key).strip().rstrip("."): value for key, value in answer.items()}
+    return [normalize_category(answer.get(str(number), "")) for number in range(1, count + 1)]
+
+
+def classification_context(examples, backend=None):
+    """Cache fingerprint of the model, prompt template and few-shot examples."""
+    backend = backend or load_backend()
+    return context_fingerprint(backend.model, PROMPT_INTRO + TASK_PROMPT_TEMPLATE, examples)
+
+
+def classify_task_probabilities(task, examples, backend=None):
+    """
+    Classify one task with the answer restricted to CATEGORIES.
+
+    Returns (category, probabilities): the most probable canonical label (ties go to
+    the earlier entry in CATEGORIES) and a {category: probability} dict over all of them,
+    or (None, None) when the backend couldn't resolve the answer to any category.
+    """
+    backend = backend or load_backend()
+    with instrumentation.stage("build_prompt"):
+        prefix, suffix = build_prompt_parts(examples, task)
+    with instrumentation.stage("llm_call"):
+        probabilities = backend.label_probabilities(prefix, suffix, CATEGORIES)
+    instrumentation.count("llm_calls")
+    if probabilities is None:
+        instrumentation.count("llm_unresolved")
+        return None, None
+    predicted_category = max(CATEGORIES, key=lambda category: probabilities[category])
+    return predicted_category, probabilities
+
+
+def classify_task(task, examples, cache=None, context=None, backend=None):
+    """
+    Predict the category for a single task, consulting the classification cache first.
+
+    Pass a precomputed `context` (from classification_context) when classifying many
+    tasks against the same examples so the example set is only hashed once. The result
+    is one of CATEGORIES, or None when the model's answer names none of them; such
+    answers are not cached, so the next run asks again.
+    """
+    backend = backend or load_backend()
+    if cache is not None:
+        context = context or classification_context(examples, backend)
+        # Entries cached before answers were constrained may hold free text; treat those as misses
+        cached_category = normalize_category(cache.get(task, context) or "")
+        if cached_category is not None:
+            return cached_category
+
+    predicted_category, _ = classify_task_probabilities(task, examples, backend)
+
+    if cache is not None and predicted_category is not None:
+        cache.set(task, context, predicted_category)
+    return predicted_category
+
+
+def classify_batch(tasks, examples, cache=None, context=None, backend=None):
+    """
+    Classify several tasks with a single LLM request.
+
+    Cached tasks are answered from the cache; the rest are packed into one numbered
+    prompt that asks for a JSON answer. Items whose answer is missing or isn't one of
+    CATEGORIES are re-queried one at a time with classify_task. Returns the categories
+    in input order, None for any task that stays unresolved.
+    """
+    backend = backend or load_backend()
+    predicted_categories = [None] * len(tasks)
+    if cache is not None:
+        context = context or classification_context(examples, backend)
+        predicted_categories = [normalize_category(cache.get(task, context) or "") for task in tasks]
+
+    pending = [idx for idx, category in enumerate(predicted_categories) if category is None]
+    if not pending:
+        return predicted_categories
+
+    with instrumentation.stage("build_prompt"):
+        prefix, suffix = build_batch_prompt_parts(examples, [tasks[idx] for idx in pending])
+    with instrumentation.stage("llm_call"):
+        content = backend.generate(prefix, suffix, json_output=True, max_tokens=BATCH_TOKENS_PER_TASK * len(pending))
+    instrumentation.count("llm_calls")
+    answers = parse_batch_response(content, len(pending))
+    instrumentation.count("batch_answers_invalid", answers.count(None))
+
+    for idx, category in zip(pending, answers):
+        if category is None:
+            category = classify_task(tasks[idx], examples, backend=backend)
+        predicted_categories[idx] = category
+        if cache is not None and category is not None:
+            cache.set(tasks[idx], context, category)
+    return predicted_categories
+
+
+@functools.lru_cache(maxsize=None)
+def _client_error_types():
+    """(httpx timeout types, ollama response error types), imported only once a call has failed."""
+    timeouts, responses = (), ()
+    try:
+        import httpx
+        timeouts = (httpx.TimeoutException,)
+    except ImportError:
+        pass
+    try:
+        import ollama
+        responses = (ollama.ResponseError,)
+    except ImportError:
+        pass
+    return timeouts, responses
+
+
+def is_transient_llm_error(error):
+    """True for failures worth retrying: connection errors, timeouts and server responses with a 5xx or 429 status."""
+    timeouts, responses = _client_error_types()
+    if isinstance(error, TRANSIENT_LLM_ERRORS + timeouts):
+        return True
+    if isinstance(error, responses):
+        return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def call_with_retry(func, *args, max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF_SECONDS, **kwargs):
+    """Call `func`, retrying transient LLM failures with exponential backoff; other errors are raised at once."""
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if attempt == max_retries or not is_transient_llm_error(error):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def classify_tasks_concurrently(tasks, examples, cache=None, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE, backend=None):
+    """
+    Classify tasks on a bounded thread pool, `batch_size` tasks per LLM request.
+
+    Yields (index, predicted_category, latency_seconds) in completion order, where
+    index is the task's position in `tasks` so callers can restore input order.
+    Tasks classified in one batch share its round-trip latency.
+    """
+    backend = backend or load_backend()
+    context = classification_context(examples, backend) if cache is not None else None
+    batches = [list(range(start, min(start + batch_size, len(tasks)))) for start in range(0, len(tasks), batch_size)]
+
+    def timed_classify(positions):
+        start = time.perf_counter()
+        if len(positions) == 1:
+            predicted_categories = [call_with_retry(
+                classify_task, tasks[positions[0]], examples, cache=cache, context=context, backend=backend
+            )]
+        else:
+            batch = [tasks[position] for position in positions]
+            predicted_categories = call_with_retry(
+                classify_batch, batch, examples, cache=cache, context=context, backend=backend
+            )
+        return predicted_categories, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # each worker runs in a copy of this context so it records into the caller's collector
+        futures = {
+            pool.submit(contextvars.copy_context().run, timed_classify, positions): positions
+            for positions in batches
+        }
+        for future in as_completed(futures):
+            predicted_categories, latency = future.result()
+            for idx, predicted_category in zip(futures[future], predicted_categories):
+                yield idx, predicted_category, latency
 
 
 def apply_operator(field_value, operator, rule_value):
-    """Helper to apply flexible comparison operators."""
-    if operator == "==":
-        return field_value == rule_value
-    elif operator == "!=":
-        return field_value != rule_value
-    elif operator == "<":
-        return float(field_value) < float(rule_value)
-    elif operator == ">":
-        return float(field_value) > float(rule_value)
-    elif operator == "<=":
-        return float(field_value) <= float(rule_value)
-    elif operator == ">=":
-        return float(field_value) >= float(rule_value)
-    elif operator == "in":
-        return field_value in eval(rule_value)  # careful — rule_value must be a Python list string
-    else:
-        return False
-
-def rank_task(task_text, predicted_category, patient_info, priority_rules_df):
-    task_text_lower = task_text.lower()
-    score = 0
-
-    patient_id = patient_info["patient_id"]
-    patient_name = patient_info["patient_name"]
-
-    print(f"\n--- Scoring for Task: \"{task_text}\" (Category: {predicted_category}) ---")
-    print(f"Patient: {patient_name} (ID: {patient_id})")
-
-    point_reasons = []
-
-    for _, rule in priority_rules_df.iterrows():
-        match = False
-        reasons_to_add = []  # Hold reasons temporarily, don't log immediately!
-
-        # Task category match
-        if isinstance(rule["task_category"], str) and predicted_category == rule["task_category"]:
-            match = True
-            reasons_to_add.append(f"Matched Task Category: {rule['task_category']}")
-
-        # Keyword match
-        if isinstance(rule["keyword"], str) and rule["keyword"].lower() in task_text_lower:
-            match = True
-            reasons_to_add.append(f"Matched Keyword: {rule['keyword']}")
-
-        # Patient field match
-        if isinstance(rule["patient_field"], str):
-            patient_value = patient_info.get(rule["patient_field"], None)
-            if patient_value is not None:
-                if apply_operator(patient_value, rule["patient_field_operator"], rule["patient_field_value"]):
-                    match = True
-                    reasons_to_add.append(f"Matched Patient Field: {rule['patient_field']}={patient_value}")
-
-        # 🚨 Now check condition (AFTER initial matching)
-        if match and isinstance(rule.get("condition_field"), str):
-            condition_value_patient = patient_info.get(rule["condition_field"], None)
-            if condition_value_patient != rule["condition_value"]:
-                match = False
-                reasons_to_add = []  # 🚨 Clear any earlier reasons if condition fails
-
-        # Only if truly matched, apply points and reasons
-        if match:
-            score += rule["points"]
-            point_reasons.extend(reasons_to_add)  # Log reasons now
-            point_reasons.append(f"+{rule['points']} points from Rule {rule['rule_id']}")
-
-
-    # Print why points were added
-    for reason in point_reasons:
-        print(reason)
-
-    print(f"Total Score for Task: {score}")
-
-    # Map score to priority rank
-    if score >= 10:
-        priority_rank = 1
-    elif score >= 7:
-        priority_rank = 2
-    elif score >= 4:
-        priority_rank = 3
-    else:
-        priority_rank = 4
-
-    return priority_rank, score, point_reasons
+    """
+    Helper to apply flexible comparison operators.
+
+    Parses `rule_value` on every call; scoring many tasks should go through
+    scoring.CompiledRules, which compiles each rule's predicate once.
+    """
+    return compile_predicate(operator, rule_value).matches(field_value)
+
+def rank_task(task_text, predicted_category, patient_info, priority_rules):
+    """
+    Priority (rank, score, reason lines) of one task.
+
+    `priority_rules` is a CompiledRules, or a rules DataFrame compiled on each call;
+    pass CompiledRules when ranking more than one task. Only the rules the task's
+    category, text and patient values reach through the rule index are visited.
+    `patient_info` is None for a task without a panel patient: task rules only.
+    """
+    if not isinstance(priority_rules, CompiledRules):
+        priority_rules = CompiledRules(priority_rules)
+    matches = priority_rules.index.matches(task_text, predicted_category, patient_info)
+    instrumentation.count("rank_task_calls")
+    instrumentation.count("rule_matches", len(matches))
+    return priority_rules.score_matches(matches)
+
+
+def classify_panel(tasks_df, examples, cache=None, max_workers=MAX_WORKERS, knn=None, batch_size=BATCH_SIZE,
+                   backend=None, checkpoint=None, report_progress=False,
+                   near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Categorize every task, trying the k-NN fast path (if given) before the LLM.
+
+    Returns a DataFrame with one row per task in input order (RangeIndex) and columns
+    "Predicted Category", "Classification Source" ("knn", "llm", or "unresolved" when
+    the model's answer named no category and Predicted Category is None),
+    "Classification Confidence" (k-NN vote confidence, NaN without a k-NN stage) and
+    "Classification Latency (s)".
+
+    Tasks with the same normalized text (or, with `near_duplicate_threshold`, nearly
+    the same text; see dedup.TaskGroups) are classified once and share the result.
+    The frame's attrs["dedup"] holds the task and group counts.
+
+    With a `checkpoint` (checkpoint.TaskCheckpoint), tasks it already holds are not
+    classified again and every new result is stored as soon as it arrives (unresolved
+    ones excepted, so a resumed run retries them).
+    `report_progress` prints progress, throughput and ETA while the LLM works.
+    """
+    tasks = tasks_df["TASK"].tolist()
+    predicted_categories = [None] * len(tasks)
+    sources = ["llm"] * len(tasks)
+    confidences = np.full(len(tasks), np.nan)
+    latencies = [None] * len(tasks)
+    pending = list(range(len(tasks)))
+
+    keys = None
+    if checkpoint is not None:
+        keys = task_keys(tasks_df)
+        completed = checkpoint.load(keys)
+        pending = []
+        for position, key in enumerate(keys):
+            if key in completed:
+                predicted_categories[position], sources[position], confidence, latencies[position] = completed[key]
+                confidences[position] = np.nan if confidence is None else confidence
+            else:
+                pending.append(position)
+        if len(pending) < len(tasks):
+            print(f"Resuming: {len(tasks) - len(pending)} of {len(tasks)} task(s) restored from the checkpoint")
+    progress = ProgressReporter(len(tasks), already_done=len(tasks) - len(pending)) if report_progress else None
+
+    # Classify one task per group of duplicates; `members` maps it to every position it stands for
+    with instrumentation.stage("dedup"):
+        groups = TaskGroups([tasks[position] for position in pending], near_duplicate_threshold)
+        members = {
+            pending[group_positions[0]]: [pending[idx] for idx in group_positions] for group_positions in groups.members()
+        }
+    instrumentation.count("dedup_tasks", groups.n_tasks)
+    instrumentation.count("dedup_groups", len(groups))
+    if report_progress and len(groups) < groups.n_tasks:
+        print(f"Deduplicated {groups.n_tasks} task(s) to {len(groups)} distinct "
+              f"({groups.stats()['dedup_ratio']:.1f}x fewer classifications)")
+
+    def assign(representative, category, source, latency):
+        """Give the representative's result to its whole group; returns the group's checkpoint rows."""
+        confidence = confidences[representative]
+        for position in members[representative]:
+            predicted_categories[position] = category
+            sources[position] = source
+            confidences[position] = confidence
+            latencies[position] = latency
+        if progress is not None:
+            progress.update(len(members[representative]))
+        if checkpoint is None or category is None:
+            return []
+        stored_confidence = None if np.isnan(confidence) else float(confidence)
+        return [(keys[position], category, source, stored_confidence, latency) for position in members[representative]]
+
+    representatives = list(members)
+    llm_positions = representatives
+    if knn is not None and representatives:
+        start = time.perf_counter()
+        with instrumentation.stage("knn"):
+            knn_labels, knn_confidences = knn.predict([tasks[position] for position in representatives])
+        knn_latency = round((time.perf_counter() - start) / len(representatives), 6)
+        confident = knn_confidences >= knn.threshold
+        confidences[representatives] = knn_confidences
+        knn_positions = [representatives[idx] for idx in np.flatnonzero(confident)]
+        llm_positions = [representatives[idx] for idx in np.flatnonzero(~confident)]
+        knn.record(len(knn_positions), len(llm_positions))
+        instrumentation.count("knn_fast_path", len(knn_positions))
+        knn_results = []
+        for position, label in zip(knn_positions, np.asarray(knn_labels, dtype=object)[confident]):
+            knn_results.extend(assign(position, label, "knn", knn_latency))
+        if checkpoint is not None:
+            checkpoint.record(knn_results)
+
+    llm_tasks = [tasks[position] for position in llm_positions]
+    llm_results = classify_tasks_concurrently(
+        llm_tasks, examples, cache=cache, max_workers=max_workers, batch_size=batch_size, backend=backend
+    )
+    for idx, predicted_category, latency in llm_results:
+        source = "llm" if predicted_category is not None else "unresolved"
+        results = assign(llm_positions[idx], predicted_category, source, round(latency, 6))
+        if checkpoint is not None:
+            checkpoint.record(results)
+
+    classification = pd.DataFrame({
+        "Predicted Category": predicted_categories,
+        "Classification Source": sources,
+        "Classification Confidence": np.round(confidences, 3),
+        "Classification Latency (s)": latencies,
+    })
+    classification.attrs["dedup"] = groups.stats()
+    return classification
+
+
+def panel_scorer(tasks_df, predicted_categories, patient_store):
+    """
+    Join categorized tasks to their patients once and return a PanelScorer.
+
+    Keep the scorer around to re-rank the same panel after the rules change: only
+    rules whose matching criteria changed are re-evaluated. Tasks without a matching
+    patient are scored on task rules only.
+    """
+    with instrumentation.stage("patient_join"):
+        patients, matched = patient_store.join(tasks_df["patient_id"])
+    return PanelScorer(
+        tasks_df["TASK"].tolist(), predicted_categories, patients, tracked_keywords=CRITICAL_KEYWORDS,
+        patient_matched=matched,
+    )
+
 
+def score_tasks(tasks_df, scorer, compiled_rules):
+    """
+    Rank already-categorized tasks with the vectorized rule engine — the whole-frame
+    equivalent of calling rank_task per row. Returns the results sorted by priority.
+    """
+    with instrumentation.stage("rule_scoring"):
+        priority_ranks, scores, matches = scorer.score(compiled_rules)
+    instrumentation.count("rules_evaluated", scorer.rules_evaluated)
+    instrumentation.count("rule_matches", scorer.rule_matches)
+
+    with instrumentation.stage("build_output"):
+        output_df = build_output_frame(tasks_df, scorer.predicted_categories, priority_ranks, scores, matches)
+        output_df.insert(
+            output_df.columns.get_loc("Patient Factors"), "Critical Keywords",
+            [", ".join(keywords) for keywords in scorer.tracked_keyword_hits()],
+        )
+    with instrumentation.stage("sort"):
+        return output_df.sort_values(by=["Priority Rank", "Priority Score"], ascending=[True, False])
+
+
+def build_output_frame(tasks_df, predicted_categories, priority_ranks, scores, matches):
+    """The results table for scored tasks, in input order; "Patient Factors" is rendered from `matches`."""
+    output_df = pd.DataFrame({
+        "Patient ID": tasks_df["patient_id"].to_numpy(),
+        "Patient Name": tasks_df["patient_name"].to_numpy(),
+        "Task": tasks_df["TASK"].to_numpy(),
+    })
+    if "task_source" in tasks_df.columns:
+        output_df["Task Source"] = tasks_df["task_source"].to_numpy()
+    output_df["Predicted Category"] = predicted_categories
+    output_df["Priority Rank"] = priority_ranks
+    output_df["Priority Label"] = [PRIORITY_LABELS[rank] for rank in priority_ranks]
+    output_df["Priority Score"] = scores
+    output_df["Patient Factors"] = matches.render()
+    return output_df
+
+
+def prioritize_tasks(tasks_df, patient_store, priority_rules_df, examples, cache=None, max_workers=MAX_WORKERS, knn=None,
+                     batch_size=BATCH_SIZE, backend=None, checkpoint=None, report_progress=False,
+                     near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD, compiled_rules=None):
+    """
+    Categorize and rank every task in `tasks_df`.
+
+    The rules are compiled first, so a malformed rule raises rules.RuleValidationError
+    before any LLM call. Confident k-NN predictions skip the LLM; the rest are classified
+    concurrently. Once every category is in, the whole panel is scored in one vectorized
+    pass. Returns the results sorted by priority, with the classification details from
+    classify_panel as extra columns. `checkpoint`, `report_progress` and
+    `near_duplicate_threshold` are passed on to classify_panel. Pass `compiled_rules`
+    (CompiledRules of `priority_rules_df`) to reuse rules already compiled for earlier
+    files or chunks.
+    """
+    if compiled_rules is None:
+        compiled_rules = CompiledRules(priority_rules_df)  # validate before paying for any LLM calls
+    classification = classify_panel(
+        tasks_df, examples, cache=cache, max_workers=max_workers, knn=knn, batch_size=batch_size, backend=backend,
+        checkpoint=checkpoint, report_progress=report_progress, near_duplicate_threshold=near_duplicate_threshold
+    )
+
+    scorer = panel_scorer(tasks_df, classification["Predicted Category"].tolist(), patient_store)
+    output_df = score_tasks(tasks_df, scorer, compiled_rules)
+    return output_df.join(classification.drop(columns="Predicted Category"))
+
+
+def priority_sort_key(row):
+    """Output order for a result row read back from CSV: priority rank ascending, then score descending."""
+    return int(row["Priority Rank"]), -float(row["Priority Score"])
+
+
+def prioritize_csv_streaming(tasks_path, output_path, patient_store, priority_rules_df, examples, chunksize,
+                             spill_dir=STREAM_SPILL_DIR, **prioritize_kwargs):
+    """
+    Prioritize a task table of any size in bounded memory.
+
+    Tasks are read `chunksize` rows at a time (from CSV, Parquet or Arrow) and each chunk is ranked with
+    prioritize_tasks (extra keyword arguments are passed through) and saved as a sorted
+    run under `spill_dir` as soon as it finishes. Re-running after an interruption skips
+    the chunks already saved, as long as the task file, rules, patient panel and examples
+    are unchanged. The runs are then merge-sorted into `output_path`, which must be a
+    CSV since the merge streams rows as text.
+
+    Returns the number of tasks written.
+    """
+    if table_format(output_path) != CSV:
+        raise ValueError(f"Streaming runs write CSV output; got {output_path}")
+    compiled_rules = CompiledRules(priority_rules_df)  # validate before paying for any LLM calls
+    runs = ChunkRunStore(spill_dir, {
+        "tasks": file_fingerprint(tasks_path),
+        "chunksize": chunksize,
+        "rules": frame_digest(priority_rules_df),
+        "patients": frame_digest(patient_store.panel),
+        "examples": examples_fingerprint(examples),
+    })
+    completed = set(runs.completed())
+    if completed:
+        print(f"Resuming: {len(completed)} chunk(s) already ranked in {spill_dir}")
+
+    for chunk_number, chunk in enumerate(iter_table_chunks(tasks_path, chunksize)):
+        if chunk_number in completed:
+            continue
+        assert "TASK" in chunk.columns, "Expected 'TASK' column not found in the unlabeled tasks file."
+        chunk = chunk.reset_index(drop=True)
+        unmatched = patient_store.unmatched_tasks(chunk)
+        if len(unmatched):
+            print(f"⚠️ Chunk {chunk_number}: {len(unmatched)} task(s) reference patients missing from the panel")
+        runs.write(chunk_number, prioritize_tasks(
+            chunk, patient_store, priority_rules_df, examples, compiled_rules=compiled_rules, **prioritize_kwargs
+        ))
+        print(f"Chunk {chunk_number}: {len(chunk)} task(s) ranked")
+
+    n_tasks = merge_sorted_runs(runs.run_paths(), output_path, priority_sort_key)
+    runs.clear()
+    return n_tasks
 
 
 # === Main Script ===
 def main():
+    if not RUN_REPORT_PATH:
+        run_prioritization()
+        return
+    with instrumentation.collect() as stats:
+        run_prioritization()
+    instrumentation.write_report(stats, RUN_REPORT_PATH)
+    print("\n".join(instrumentation.format_report(stats.report())))
+    print(f"Run report saved to {RUN_REPORT_PATH}")
+
+
+def run_prioritization():
     # Load data
-    patient_panel_df = pd.read_csv(PATIENT_PANEL_PATH)
-    priority_rules = pd.read_csv(PRIORITY_RULES_PATH)
-    example_sample = pd.read_csv(CURATED_EXAMPLES_PATH)
-    unlabeled_df = pd.read_csv(UNLABELED_TASKS_PATH)
+    with instrumentation.stage("load_tables"):
+        patient_panel_df = read_table(PATIENT_PANEL_PATH)
+        priority_rules = read_table(PRIORITY_RULES_PATH)
+        example_sample = read_table(CURATED_EXAMPLES_PATH)
 
-    assert "TASK" in unlabeled_df.columns, "Expected 'TASK' column not found in the unlabeled tasks file."
     required_columns = ['rule_id', 'task_category', 'keyword', 'patient_field', 'patient_field_operator', 'patient_field_value', 'points']
     for col in required_columns:
         assert col in priority_rules.columns, f"Missing expected column: {col}"
 
-    results = []
-
-    for idx, row in unlabeled_df.iterrows():
-        patient_id = row["patient_id"]
-        patient_name = row["patient_name"]
-        task = row["TASK"]
+    patient_store = PatientStore(patient_panel_df)
 
-        patient_info = patient_panel_df[patient_panel_df["patient_id"] == patient_id].iloc[0]
-
-        prompt = build_prompt(example_sample, task)
-        response = ollama.chat(
-            model="llama3.2",
-            messages=[{"role": "user", "content": prompt}]
+    knn = None
+    if USE_KNN_FAST_PATH:
+        knn = KNNClassifier.from_frames(
+            example_sample, read_table(TRAINING_TASKS_PATH), normalize_label=normalize_category,
+            threshold=KNN_CONFIDENCE_THRESHOLD,
         )
-        predicted_category = response["message"]["content"].strip()
-
-        priority_rank, score, point_reasons = rank_task(task, predicted_category, patient_info, priority_rules)
 
-        results.append({
-            "Patient ID": patient_id,
-            "Patient Name": patient_name,
-            "Task": task,
-            "Predicted Category": predicted_category,
-            "Priority Rank": priority_rank,
-            "Priority Label": PRIORITY_LABELS[priority_rank],
-            "Priority Score": score,
-            "Patient Factors": "\n".join(f"• {reason}" for reason in point_reasons) if point_reasons else ""
-        })
+    # Results already classified by an interrupted run over the same file are reused
+    checkpoint = TaskCheckpoint(
+        run_id(file_sha256(UNLABELED_TASKS_PATH), classification_context(example_sample)), CHECKPOINT_PATH
+    )
 
-    output_df = pd.DataFrame(results)
-    output_df = output_df.sort_values(by=["Priority Rank", "Priority Score"], ascending=[True, False])
+    if STREAM_CHUNK_SIZE:
+        cache = ClassificationCache(CLASSIFICATION_CACHE_DIR)
+        n_tasks = prioritize_csv_streaming(
+            UNLABELED_TASKS_PATH, OUTPUT_PATH, patient_store, priority_rules, example_sample, STREAM_CHUNK_SIZE,
+            cache=cache, knn=knn, checkpoint=checkpoint, report_progress=True
+        )
+        print(f"✅ Categorization, ranking, and labeling complete for {n_tasks} tasks. Saved to {OUTPUT_PATH}")
+        stats = cache.stats()
+        print(f"Classification cache: {stats['hits']} hits, {stats['misses']} misses")
+        cache.close()
+        checkpoint.discard()
+        checkpoint.close()
+        return
+
+    with instrumentation.stage("load_tables"):
+        unlabeled_df = read_table(UNLABELED_TASKS_PATH)
+    assert "TASK" in unlabeled_df.columns, "Expected 'TASK' column not found in the unlabeled tasks file."
+    unmatched = patient_store.unmatched_tasks(unlabeled_df)
+    if len(unmatched):
+        print(f"⚠️ {len(unmatched)} task(s) reference patients missing from {PATIENT_PANEL_PATH}; "
+              f"they will be scored without patient factors:")
+        print(unmatched.to_string())
+
+    cache = ClassificationCache(CLASSIFICATION_CACHE_DIR)
+    output_df = prioritize_tasks(
+        unlabeled_df, patient_store, priority_rules, example_sample, cache=cache, knn=knn,
+        checkpoint=checkpoint, report_progress=True
+    )
 
-    output_df.to_csv(OUTPUT_PATH, index=False)
+    with instrumentation.stage("write_output"):
+        write_table(output_df, OUTPUT_PATH)
+    checkpoint.discard()
+    checkpoint.close()
     print(f"✅ Categorization, ranking, and labeling complete. Saved to {OUTPUT_PATH}")
+    unresolved = output_df[output_df["Classification Source"] == "unresolved"]
+    if len(unresolved):
+        print(f"⚠️ {len(unresolved)} task(s) got an answer naming no category; they were ranked without "
+              f"category points and will be asked again next run:")
+        print(unresolved[["Patient ID", "Task"]].to_string(index=False))
     print(output_df["Priority Label"].value_counts())
+    latencies = output_df["Classification Latency (s)"]
+    print(f"Classification latency: mean {latencies.mean():.3f}s, p95 {latencies.quantile(0.95):.3f}s, max {latencies.max():.3f}s")
+    if knn is not None:
+        knn_stats = knn.stats()
+        print(f"k-NN fast path: {knn_stats['fast_path']} tasks, {knn_stats['llm_fallbacks']} sent to the LLM "
+              f"({knn_stats['fallback_rate']:.0%} fallback)")
+    stats = cache.stats()
+    print(f"Classification cache: {stats['hits']} hits, {stats['misses']} misses")
+    cache.close()
 
 # === Only run main() if called directly ===
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
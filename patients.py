@@ -0,0 +1,76 @@
+"""
+Indexed access to the patient panel.
+
+Patient IDs are normalized once ("001", 1 and 1.0 all become "1") and the panel is
+indexed by that key, so looking up one patient is a hash probe and attaching patient
+rows to a whole task list is a single vectorized join. Tasks whose patient isn't in
+the panel are reported together instead of failing one at a time.
+"""
+import numpy as np
+import pandas as pd
+
+
+def normalize_patient_id(patient_id):
+    """Canonical string form of a patient ID, ignoring zero-padding and int/float/str differences."""
+    if pd.isna(patient_id):
+        return None
+    text = str(patient_id).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return str(int(number)) if number.is_integer() else text
+
+
+def normalize_patient_ids(patient_ids):
+    """Vectorized normalize_patient_id: each distinct ID is normalized once."""
+    codes, uniques = pd.factorize(pd.Series(patient_ids, dtype=object))
+    # Trailing None so missing IDs (code -1) normalize to None
+    normalized = np.array([normalize_patient_id(value) for value in uniques] + [None], dtype=object)
+    return pd.Index(normalized[codes], dtype=object)
+
+
+class PatientStore:
+    """The patient panel indexed by normalized patient ID (first row wins on duplicates)."""
+
+    def __init__(self, patient_panel_df):
+        keys = normalize_patient_ids(patient_panel_df["patient_id"])
+        first = ~keys.duplicated()
+        self.panel = patient_panel_df[first]
+        self._by_id = self.panel.set_index(keys[first])
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, patient_id):
+        return normalize_patient_id(patient_id) in self._by_id.index
+
+    def get(self, patient_id):
+        """Return the patient's row as a Series, or None if the ID isn't in the panel."""
+        key = normalize_patient_id(patient_id)
+        if key not in self._by_id.index:
+            return None
+        return self.panel.iloc[self._by_id.index.get_loc(key)]
+
+    def unmatched_tasks(self, tasks_df):
+        """Rows of `tasks_df` whose patient_id has no match in the panel."""
+        keys = normalize_patient_ids(tasks_df["patient_id"])
+        return tasks_df[~keys.isin(self._by_id.index)]
+
+    def join(self, patient_ids):
+        """
+        Patient rows aligned one-to-one with `patient_ids`, plus a boolean array marking
+        which IDs were found.
+
+        Unmatched IDs get an all-missing row, which scoring must not test patient rules
+        against (`!=` holds for a missing value); pass the mask on to scoring.PanelScorer.
+        In that case the frame is built with object columns so integer fields of matched
+        patients keep their original values.
+        """
+        keys = normalize_patient_ids(patient_ids)
+        matched = keys.isin(self._by_id.index)
+        if matched.all():
+            patients = self._by_id.loc[keys]
+        else:
+            patients = self._by_id.astype(object).reindex(keys)
+        return patients.reset_index(drop=True), matched
@@ -0,0 +1,232 @@
+"""
+Typed predicates for priority-rule patient-field comparisons.
+
+Rule values arrive as strings from a CSV (possibly uploaded through the Streamlit
+app), so they are parsed exactly once into predicate objects: a frozenset for `in`,
+a float for numeric operators and a normalized scalar for equality. Nothing is ever
+passed to eval(), and a malformed rule is reported by its rule_id at load time
+rather than failing (or executing) mid-scoring.
+"""
+import ast
+import math
+import numbers
+
+import numpy as np
+import pandas as pd
+
+SUPPORTED_OPERATORS = ["==", "!=", "<", ">", "<=", ">=", "in"]
+MATCH_COLUMNS = [
+    "task_category", "keyword", "patient_field", "patient_field_operator", "patient_field_value",
+    "condition_field", "condition_value",
+]
+
+
+class RuleValidationError(ValueError):
+    """Raised when a priority rule can't be compiled. `errors` lists one message per bad rule."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("Invalid priority rules:\n" + "\n".join(f"- {error}" for error in self.errors))
+
+
+def normalize_value(value):
+    """
+    Canonical form used for equality and membership tests.
+
+    Missing values become None, booleans (typed yes/no columns) become "yes"/"no",
+    anything numeric (including numeric strings such as "30" or the zero-padded "001")
+    becomes a float, and other strings are stripped and lower-cased.
+    """
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return "yes" if value else "no"
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, numbers.Number):
+        number = float(value)
+        return None if math.isnan(number) else number
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        number = float(text)
+    except ValueError:
+        return text.lower()
+    return None if math.isnan(number) else number
+
+
+def display_value(value):
+    """A patient value as shown in match reasons: booleans read as yes/no, like the source CSV."""
+    if isinstance(value, (bool, np.bool_)):
+        return "yes" if value else "no"
+    return value
+
+
+def as_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class Predicate:
+    """A compiled `field <operator> value` test."""
+
+    operator = None
+
+    def matches(self, field_value):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.operator!r}, {self.value!r})"
+
+
+class EqualsPredicate(Predicate):
+    operator = "=="
+
+    def __init__(self, value):
+        self.value = normalize_value(value)
+
+    def matches(self, field_value):
+        return self.value is not None and normalize_value(field_value) == self.value
+
+
+class NotEqualsPredicate(EqualsPredicate):
+    operator = "!="
+
+    def matches(self, field_value):
+        return not super().matches(field_value)
+
+
+class NumericPredicate(Predicate):
+    COMPARISONS = {
+        "<": lambda left, right: left < right,
+        ">": lambda left, right: left > right,
+        "<=": lambda left, right: left <= right,
+        ">=": lambda left, right: left >= right,
+    }
+
+    def __init__(self, operator, value):
+        number = as_float(value)
+        if number is None:
+            raise ValueError(f"operator '{operator}' needs a number, got {value!r}")
+        self.operator = operator
+        self.value = number
+        self._compare = self.COMPARISONS[operator]
+
+    def matches(self, field_value):
+        number = as_float(field_value)
+        return number is not None and self._compare(number, self.value)
+
+
+class MembershipPredicate(Predicate):
+    operator = "in"
+
+    def __init__(self, value):
+        if isinstance(value, str):
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                raise ValueError(f"operator 'in' needs a list literal like ['a', 'b'], got {value!r}") from None
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            raise ValueError(f"operator 'in' needs a list literal like ['a', 'b'], got {value!r}")
+        self.value = frozenset(normalize_value(item) for item in value) - {None}
+
+    def matches(self, field_value):
+        return normalize_value(field_value) in self.value
+
+
+def compile_predicate(operator, rule_value):
+    """Build the predicate for one operator/value pair. Raises ValueError if either is invalid."""
+    if operator == "==":
+        return EqualsPredicate(rule_value)
+    if operator == "!=":
+        return NotEqualsPredicate(rule_value)
+    if operator in NumericPredicate.COMPARISONS:
+        return NumericPredicate(operator, rule_value)
+    if operator == "in":
+        return MembershipPredicate(rule_value)
+    raise ValueError(f"unsupported operator {operator!r} (expected one of {', '.join(SUPPORTED_OPERATORS)})")
+
+
+def _is_set(value):
+    return isinstance(value, str) and value.strip() != ""
+
+
+def _is_blank(value):
+    """True for a cell left empty: None, NaN/NA or whitespace."""
+    if isinstance(value, str):
+        return not value.strip()
+    return value is None or bool(pd.isna(value))
+
+
+def is_blank_rule(rule):
+    """True for a record with no matching criteria and no points, e.g. a row just added in the rules editor."""
+    return all(_is_blank(rule.get(column)) for column in MATCH_COLUMNS + ["points"])
+
+
+def _rule_label(rule_id, row_number):
+    """How errors name a rule: "Rule 7" (also for a rule_id read as 7.0), or "Row 3" when it has no rule_id."""
+    if _is_blank(rule_id) and row_number is not None:
+        return f"Row {row_number}"
+    if isinstance(rule_id, float) and rule_id.is_integer():
+        rule_id = int(rule_id)
+    return f"Rule {rule_id}"
+
+
+def compile_rule(rule, row_number=None):
+    """
+    Parse one rules-table record (a dict) into a normalized rule dict.
+
+    Patient-field comparisons become a `predicate`; condition fields become an
+    equality predicate under `condition`. Raises RuleValidationError naming the rule,
+    or its 1-based `row_number` when it has no rule_id.
+    """
+    rule_id = rule.get("rule_id")
+    try:
+        points = as_float(rule.get("points"))
+        if points is None:
+            raise ValueError(f"points must be a number, got {rule.get('points')!r}")
+
+        predicate = None
+        if _is_set(rule.get("patient_field")):
+            predicate = compile_predicate(rule.get("patient_field_operator"), rule.get("patient_field_value"))
+
+        condition = None
+        if _is_set(rule.get("condition_field")):
+            condition = EqualsPredicate(rule.get("condition_value"))
+            if condition.value is None:
+                raise ValueError(f"condition_field '{rule['condition_field']}' has no condition_value")
+    except ValueError as error:
+        raise RuleValidationError([f"{_rule_label(rule_id, row_number)}: {error}"]) from None
+
+    return {
+        "rule_id": rule_id,
+        "points": rule["points"],
+        # Everything that decides *which* tasks match (not what they're worth); used to
+        # reuse match results across edits of the rules table
+        "match_key": tuple(repr(rule.get(column)) for column in MATCH_COLUMNS),
+        "task_category": rule["task_category"] if _is_set(rule.get("task_category")) else None,
+        "keyword": rule["keyword"] if _is_set(rule.get("keyword")) else None,
+        "patient_field": rule["patient_field"] if predicate is not None else None,
+        "predicate": predicate,
+        "condition_field": rule["condition_field"] if condition is not None else None,
+        "condition": condition,
+    }
+
+
+def compile_rules(priority_rules_df):
+    """Compile every rule in the table, skipping blank rows and reporting all invalid rules together."""
+    compiled, errors = [], []
+    for row_number, rule in enumerate(priority_rules_df.to_dict("records"), start=1):
+        if is_blank_rule(rule):
+            continue
+        try:
+            compiled.append(compile_rule(rule, row_number))
+        except RuleValidationError as error:
+            errors.extend(error.errors)
+    if errors:
+        raise RuleValidationError(errors)
+    return compiled
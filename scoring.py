@@ -0,0 +1,435 @@
+"""
+Vectorized priority-rule scoring.
+
+Each rule awards its points to a task when its category, keyword or patient-field test
+hits and its condition (if any) holds. CompiledRules parses the rules table once and
+scores a whole task×patient frame column-wise: each column a rule reads (task text,
+predicted category, patient fields) is factorized, the rule's predicate is evaluated
+once per *distinct* value, and the resulting boolean mask is broadcast back to every
+row through the factor codes. Matches are kept as compact MatchRecords rather than
+reason strings, and render to the reason text on demand.
+
+For scoring one task at a time (main.rank_task), CompiledRules.score_task goes through
+a RuleIndex, which buckets the rules by category, keyword, patient-field value and
+condition so a task only visits the rules its category, text and patient values can
+reach. Both paths give the same ranks, scores and reasons as testing every rule against
+every task; tests/test_scoring.py checks them against that row-by-row reference.
+"""
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from keyword_matcher import KeywordMatcher
+from rules import (
+    MembershipPredicate, NotEqualsPredicate, NumericPredicate, as_float, compile_rules, display_value, normalize_value,
+)
+
+# (minimum score, priority rank) — checked in order, same as rank_task
+PRIORITY_SCORE_THRESHOLDS = [(10, 1), (7, 2), (4, 3)]
+DEFAULT_PRIORITY_RANK = 4
+
+# Why a rule matched a task (bit flags, combined when several criteria hit)
+MATCH_CATEGORY = 1
+MATCH_KEYWORD = 2
+MATCH_FIELD = 4
+MATCH_KIND_NAMES = {MATCH_CATEGORY: "task_category", MATCH_KEYWORD: "keyword", MATCH_FIELD: "patient_field"}
+
+
+def _factorize(values):
+    """Factor codes plus uniques, with NaN appended so code -1 indexes it."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    return codes, list(uniques) + [float("nan")]
+
+
+def _reason_texts(rule, field_values):
+    """rank_task's reason strings for one rule: (category, keyword, one per field value, points)."""
+    return (
+        f"Matched Task Category: {rule['task_category']}",
+        f"Matched Keyword: {rule['keyword']}",
+        [f"Matched Patient Field: {rule['patient_field']}={display_value(value)}" for value in field_values]
+        if field_values else [],
+        f"+{rule['points']} points from Rule {rule['rule_id']}",
+    )
+
+
+def priority_ranks_for_scores(scores):
+    """Map an array of scores to priority ranks using the rank_task thresholds."""
+    scores = np.asarray(scores)
+    conditions = [scores >= minimum for minimum, _ in PRIORITY_SCORE_THRESHOLDS]
+    choices = [rank for _, rank in PRIORITY_SCORE_THRESHOLDS]
+    return np.select(conditions, choices, default=DEFAULT_PRIORITY_RANK)
+
+
+class CompiledRules:
+    """A priority rules table parsed once for repeated, column-wise scoring."""
+
+    def __init__(self, priority_rules_df):
+        # Raises rules.RuleValidationError naming every malformed rule
+        self.rules = compile_rules(priority_rules_df)
+        self.index = RuleIndex(self.rules)
+
+    def score_task(self, task_text, predicted_category, patient_info):
+        """
+        Score a single task, returning (priority_rank, score, reasons). Only the rules
+        reachable through the index are visited, so the cost grows with the number of
+        matching rules rather than the size of the table. `patient_info` is None for a
+        task whose patient isn't in the panel; it is scored on task rules only.
+        """
+        return self.score_matches(self.index.matches(task_text, predicted_category, patient_info))
+
+    def score_matches(self, matches):
+        """(priority_rank, score, reasons) for one task's RuleIndex.matches() result."""
+        score = 0
+        reasons = []
+        for position, kind, field_value in matches:
+            rule = self.rules[position]
+            category_text, keyword_text, field_texts, points_text = _reason_texts(rule, [field_value])
+            if kind & MATCH_CATEGORY:
+                reasons.append(category_text)
+            if kind & MATCH_KEYWORD:
+                reasons.append(keyword_text)
+            if kind & MATCH_FIELD:
+                reasons.append(field_texts[0])
+            reasons.append(points_text)
+            score += rule["points"]
+        return int(priority_ranks_for_scores(score)), score, reasons
+
+    def score(self, task_texts, predicted_categories, patients_df, patient_matched=None):
+        """
+        Score every task at once.
+
+        Parameters:
+        - task_texts: sequence of task strings.
+        - predicted_categories: sequence of category labels aligned with task_texts.
+        - patients_df (pd.DataFrame): one row of patient attributes per task, in the same order.
+        - patient_matched: optional boolean per task, False where the patient wasn't found
+          (see PatientStore.join); those tasks are scored on task rules only.
+
+        Returns:
+        - (priority_ranks, scores, matches): two NumPy arrays and a MatchRecords of every
+          (task, rule) match, the column-wise equivalent of calling score_task on each row.
+          matches.explain(i) gives the same reason lines score_task returns for row i.
+        """
+        return PanelScorer(task_texts, predicted_categories, patients_df, patient_matched=patient_matched).score(self)
+
+
+class RuleIndex:
+    """
+    Compiled rules bucketed by the criteria that can make them match.
+
+    - by_category: task_category → rule positions
+    - by_keyword: lower-cased keyword → positions, found in a text with one KeywordMatcher pass
+    - by_field_value: (patient_field, normalized value) → positions of `==` and `in` rules
+    - thresholds: patient_field → [(operator, sorted thresholds, positions)] of numeric
+      rules, resolved by bisection
+    - field_scans: patient_field → positions of `!=` rules, which match nearly every value
+      and are tested directly
+    - by_condition: (condition_field, normalized value) → positions of conditional rules
+
+    matches() only ever touches the buckets a task's category, text and patient values
+    select, plus the `!=` rules of its fields.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.by_category = {}
+        self.by_keyword = {}
+        self.by_field_value = {}
+        self.field_scans = {}
+        self.by_condition = {}
+        thresholds = {}
+        for position, rule in enumerate(rules):
+            if rule["task_category"] is not None:
+                self.by_category.setdefault(rule["task_category"], []).append(position)
+            if rule["keyword"] is not None:
+                self.by_keyword.setdefault(rule["keyword"].lower(), []).append(position)
+            predicate, field = rule["predicate"], rule["patient_field"]
+            if isinstance(predicate, NumericPredicate):
+                thresholds.setdefault((field, predicate.operator), []).append((predicate.value, position))
+            elif isinstance(predicate, NotEqualsPredicate):
+                self.field_scans.setdefault(field, []).append(position)
+            elif isinstance(predicate, MembershipPredicate):
+                for value in predicate.value:
+                    self.by_field_value.setdefault((field, value), []).append(position)
+            elif predicate is not None and predicate.value is not None:
+                self.by_field_value.setdefault((field, predicate.value), []).append(position)
+            if rule["condition"] is not None:
+                self.by_condition.setdefault((rule["condition_field"], rule["condition"].value), set()).add(position)
+
+        self.thresholds = {}
+        for (field, operator), entries in thresholds.items():
+            entries.sort()
+            self.thresholds.setdefault(field, []).append(
+                (operator, [value for value, _ in entries], [position for _, position in entries])
+            )
+        self.keywords = KeywordMatcher(self.by_keyword)
+        self.fields = sorted({rule["patient_field"] for rule in rules if rule["predicate"] is not None})
+        self.condition_fields = sorted({field for field, _ in self.by_condition})
+
+    def _field_matches(self, field, value):
+        """Positions of the rules whose `field` predicate `value` satisfies."""
+        matched = [position for position in self.field_scans.get(field, ()) if self.rules[position]["predicate"].matches(value)]
+        key = normalize_value(value)
+        if key is not None:
+            matched.extend(self.by_field_value.get((field, key), ()))
+        number = as_float(value)
+        if number is not None:
+            for operator, values, positions in self.thresholds.get(field, ()):
+                if operator == "<":
+                    matched.extend(positions[bisect.bisect_right(values, number):])
+                elif operator == "<=":
+                    matched.extend(positions[bisect.bisect_left(values, number):])
+                elif operator == ">":
+                    matched.extend(positions[:bisect.bisect_left(values, number)])
+                else:
+                    matched.extend(positions[:bisect.bisect_right(values, number)])
+        return matched
+
+    def matches(self, task_text, predicted_category, patient_info):
+        """
+        The rules one task matches, in rule order, as (position, MATCH_* bitmask, field value)
+        tuples; field value is the patient's value for rules matched on their patient field.
+        `patient_info` is a dict or Series of the patient's fields, or None when the task
+        has no patient: then only category and keyword rules without a condition can match.
+        """
+        kinds = dict.fromkeys(self.by_category.get(predicted_category, ()), MATCH_CATEGORY)
+        for keyword in self.keywords.find(task_text):
+            for position in self.by_keyword[keyword]:
+                kinds[position] = kinds.get(position, 0) | MATCH_KEYWORD
+        field_values = {}
+        conditions_met = set()
+        if patient_info is not None:
+            for field in self.fields:
+                value = patient_info.get(field)
+                if value is None:
+                    continue
+                for position in self._field_matches(field, value):
+                    kinds[position] = kinds.get(position, 0) | MATCH_FIELD
+                    field_values[position] = value
+            for field in self.condition_fields:
+                conditions_met.update(self.by_condition.get((field, normalize_value(patient_info.get(field))), ()))
+        return [
+            (position, kinds[position], field_values.get(position))
+            for position in sorted(kinds)
+            if self.rules[position]["condition"] is None or position in conditions_met
+        ]
+
+
+class PanelScorer:
+    """
+    A categorized task panel that can be re-scored against successive rules tables.
+
+    Each rule's matches are memoized under the rule's match_key (its category, keyword,
+    patient-field and condition criteria). Re-scoring after an edit only evaluates rules
+    whose criteria changed; changing points, rule IDs or rule order is just a re-sum.
+
+    Keywords are matched with one KeywordMatcher pass over each distinct task text for
+    all the keyword rules to evaluate plus `tracked_keywords` (reported per task by
+    tracked_keyword_hits(), e.g. main.CRITICAL_KEYWORDS), rather than one substring
+    scan per keyword.
+
+    Rows marked False in `patient_matched` (tasks whose patient isn't in the panel) never
+    match a patient-field test or a condition.
+    """
+
+    def __init__(self, task_texts, predicted_categories, patients_df, tracked_keywords=(), patient_matched=None):
+        self.n_tasks = len(task_texts)
+        self.predicted_categories = list(predicted_categories)
+        self.patients_df = patients_df
+        self.patient_matched = (
+            np.ones(self.n_tasks, dtype=bool) if patient_matched is None else np.asarray(patient_matched, dtype=bool)
+        )
+        self._text_codes, self._text_uniques = _factorize(
+            [t.lower() if isinstance(t, str) else t for t in task_texts]
+        )
+        self._category_codes, category_uniques = _factorize(self.predicted_categories)
+        self._category_index = {category: code for code, category in enumerate(category_uniques[:-1])}
+        self._patient_columns = {}
+        self._keyword_lookups = {}  # keyword → bool per distinct task text
+        self.tracked_keywords = [keyword.lower() for keyword in tracked_keywords]
+        self._matches = {}
+        self.rules_evaluated = 0  # rules actually evaluated by the last score() call
+        self.rule_matches = 0  # (rule, task) matches in the last score() call
+        self.matches = None  # MatchRecords of the last score() call
+
+    def _patient_column(self, field):
+        if field not in self._patient_columns:
+            self._patient_columns[field] = _factorize(self.patients_df[field].to_numpy())
+        return self._patient_columns[field]
+
+    def _match_keywords(self, keywords):
+        """Fill _keyword_lookups for any of `keywords` not yet matched, in a single pass over the texts."""
+        missing = {keyword.lower() for keyword in keywords} - self._keyword_lookups.keys()
+        if not missing:
+            return
+        matcher = KeywordMatcher(missing)
+        lookups = {keyword: np.zeros(len(self._text_uniques), dtype=bool) for keyword in matcher.keywords}
+        for code, text in enumerate(self._text_uniques):
+            for keyword in matcher.find(text):
+                lookups[keyword][code] = True
+        self._keyword_lookups.update(lookups)
+
+    def tracked_keyword_hits(self):
+        """Per task, the tracked keywords its text contains (in tracked_keywords order)."""
+        self._match_keywords(self.tracked_keywords)
+        hits = [[] for _ in range(self.n_tasks)]
+        for keyword in self.tracked_keywords:
+            for i in np.flatnonzero(self._keyword_lookups[keyword][self._text_codes]):
+                hits[i].append(keyword)
+        return hits
+
+    def _evaluate(self, rule):
+        """
+        Which rows one rule matches, and how.
+
+        Returns (matched_rows, kinds, field_codes, field_values): matched row positions, a
+        MATCH_* bitmask per matched row, the factor code of each row's patient-field value
+        (None without a patient-field test) and the distinct values those codes index.
+        """
+        no_match = np.zeros(self.n_tasks, dtype=bool)
+
+        category_match = no_match
+        if rule["task_category"] is not None and rule["task_category"] in self._category_index:
+            category_match = self._category_codes == self._category_index[rule["task_category"]]
+
+        keyword_match = no_match
+        if rule["keyword"] is not None:
+            self._match_keywords([rule["keyword"]])
+            keyword_match = self._keyword_lookups[rule["keyword"].lower()][self._text_codes]
+
+        field_match = no_match
+        field_codes = field_values = None
+        if rule["patient_field"] is not None and rule["patient_field"] in self.patients_df.columns:
+            field_codes, field_values = self._patient_column(rule["patient_field"])
+            lookup = np.array([rule["predicate"].matches(value) for value in field_values], dtype=bool)
+            field_match = lookup[field_codes] & self.patient_matched
+
+        match = category_match | keyword_match | field_match
+
+        if rule["condition_field"] is not None:
+            if rule["condition_field"] in self.patients_df.columns:
+                codes, uniques = self._patient_column(rule["condition_field"])
+                lookup = np.array([rule["condition"].matches(value) for value in uniques], dtype=bool)
+                match = match & lookup[codes] & self.patient_matched
+            else:
+                match = no_match
+
+        matched_rows = np.flatnonzero(match)
+        kinds = (
+            category_match[matched_rows] * MATCH_CATEGORY
+            | keyword_match[matched_rows] * MATCH_KEYWORD
+            | field_match[matched_rows] * MATCH_FIELD
+        ).astype(np.uint8)
+        if field_codes is not None:
+            field_codes = field_codes[matched_rows]
+        return matched_rows, kinds, field_codes, field_values
+
+    def score(self, compiled_rules):
+        """Score the panel against `compiled_rules`; see CompiledRules.score for the return value."""
+        points = [rule["points"] for rule in compiled_rules.rules]
+        scores = np.zeros(self.n_tasks, dtype=np.asarray(points).dtype if points else int)
+        matches = {}
+        record_parts = []
+        field_values = []
+        self.rules_evaluated = 0
+        self.rule_matches = 0
+
+        # One matcher pass covers every keyword rule that needs evaluating (and the tracked keywords)
+        self._match_keywords(self.tracked_keywords + [
+            rule["keyword"] for rule in compiled_rules.rules
+            if rule["keyword"] is not None and rule["match_key"] not in self._matches
+        ])
+
+        for position, rule in enumerate(compiled_rules.rules):
+            key = rule["match_key"]
+            if key not in matches:
+                matches[key] = self._matches.get(key)
+                if matches[key] is None:
+                    matches[key] = self._evaluate(rule)
+                    self.rules_evaluated += 1
+            matched_rows, kinds, field_codes, values = matches[key]
+            field_values.append(values)
+            if not len(matched_rows):
+                continue
+
+            self.rule_matches += len(matched_rows)
+            scores[matched_rows] += rule["points"]
+            record_parts.append((
+                matched_rows, np.full(len(matched_rows), position, dtype=np.int32), kinds,
+                field_codes if field_codes is not None else np.full(len(matched_rows), -1),
+            ))
+
+        # Keep only the current rules' results so deleted rules don't pin memory
+        self._matches = matches
+        self.matches = MatchRecords(self.n_tasks, compiled_rules.rules, field_values, record_parts)
+        return priority_ranks_for_scores(scores), scores, self.matches
+
+
+class MatchRecords:
+    """
+    Every (task, rule) match of one scoring pass, stored column-wise.
+
+    `task`, `rule` (position in `rules`), `kind` (MATCH_* bitmask) and `field_code`
+    (index into that rule's distinct patient-field values, -1 if none) are parallel
+    arrays ordered by task, then rule order. Explanation text is only built when asked
+    for, by explain() / render() — once per distinct reason, not once per match.
+    """
+
+    def __init__(self, n_tasks, rules, field_values, record_parts):
+        self.n_tasks = n_tasks
+        self.rules = rules
+        self.field_values = field_values
+        if record_parts:
+            task, rule, kind, field_code = (np.concatenate(column) for column in zip(*record_parts))
+        else:
+            task = rule = field_code = np.zeros(0, dtype=np.int64)
+            kind = np.zeros(0, dtype=np.uint8)
+        order = np.argsort(task, kind="stable")  # records were appended rule by rule
+        self.task, self.rule, self.kind, self.field_code = task[order], rule[order], kind[order], field_code[order]
+        self.points = np.array([rules[position]["points"] for position in self.rule]) if len(self.rule) else self.rule
+        self._bounds = np.searchsorted(self.task, np.arange(n_tasks + 1))
+        self._texts = {}
+
+    def __len__(self):
+        return len(self.task)
+
+    def _reason_texts(self, position):
+        """(category, keyword, per-field-value, points) reason strings for one rule, built once."""
+        if position not in self._texts:
+            self._texts[position] = _reason_texts(self.rules[position], self.field_values[position])
+        return self._texts[position]
+
+    def explain(self, task_index):
+        """The reason lines for one task, in rule order (same text rank_task produces)."""
+        reasons = []
+        start, stop = self._bounds[task_index], self._bounds[task_index + 1]
+        for position, kind, field_code in zip(self.rule[start:stop], self.kind[start:stop], self.field_code[start:stop]):
+            category_text, keyword_text, field_texts, points_text = self._reason_texts(position)
+            if kind & MATCH_CATEGORY:
+                reasons.append(category_text)
+            if kind & MATCH_KEYWORD:
+                reasons.append(keyword_text)
+            if kind & MATCH_FIELD:
+                reasons.append(field_texts[field_code])
+            reasons.append(points_text)
+        return reasons
+
+    def render(self, task_indices=None):
+        """Bulleted explanation per task (all tasks by default), for display or export."""
+        if task_indices is None:
+            task_indices = range(self.n_tasks)
+        return ["\n".join(f"• {reason}" for reason in self.explain(i)) for i in task_indices]
+
+    def to_frame(self):
+        """One row per (task, rule) match: task index, rule_id, match kind and points."""
+        kind_names = {
+            kind: "+".join(name for flag, name in MATCH_KIND_NAMES.items() if kind & flag)
+            for kind in np.unique(self.kind)
+        }
+        return pd.DataFrame({
+            "task": self.task,
+            "rule_id": [self.rules[position]["rule_id"] for position in self.rule],
+            "match_kind": [kind_names[kind] for kind in self.kind],
+            "points": self.points,
+        })
@@ -0,0 +1,135 @@
+"""
+Reading and writing tables as CSV, Parquet or Arrow IPC (Feather).
+
+The format follows the file extension, so every path setting in main.py and every
+--panel/--rules/input argument of batch_prioritize.py accepts any of them:
+
+    .csv                 text, as before
+    .parquet / .pq       columnar and compressed; column types are stored with the data
+    .arrow / .feather    Arrow IPC, memory-mapped on read, so other Arrow tools can
+                         read ranked results without copying them
+
+CSV stays the interchange format. The binary formats keep column types, so a panel
+converted once with typed_columns() (yes/no flags as booleans, counts as integers)
+loads without re-parsing any strings:
+
+    python storage.py data/patient_panel.csv data/patient_panel.parquet
+
+Parquet and Arrow support needs pyarrow.
+"""
+import io
+import os
+import sys
+
+import pandas as pd
+
+CSV, PARQUET, ARROW = "csv", "parquet", "arrow"
+TABLE_FORMATS = {".csv": CSV, ".parquet": PARQUET, ".pq": PARQUET, ".arrow": ARROW, ".feather": ARROW}
+UPLOAD_TYPES = [extension.lstrip(".") for extension in TABLE_FORMATS]
+YES_NO = {"yes": True, "no": False}
+
+
+def table_format(path):
+    """CSV, PARQUET or ARROW for a file name; raises ValueError for other extensions."""
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in TABLE_FORMATS:
+        raise ValueError(f"Unsupported table format {extension!r} for {path}; use one of {', '.join(TABLE_FORMATS)}")
+    return TABLE_FORMATS[extension]
+
+
+def read_table(source, name=None, columns=None):
+    """
+    Load a table from a path (or a binary file object, whose format comes from `name`).
+
+    Arrow IPC files are memory-mapped; `columns` limits a Parquet or Arrow read to those
+    columns without touching the rest of the file.
+    """
+    file_format = table_format(name or source)
+    if file_format == CSV:
+        df = pd.read_csv(source)
+        return df[columns] if columns is not None else df
+    if file_format == PARQUET:
+        return pd.read_parquet(source, columns=columns)
+    from pyarrow import feather
+
+    return feather.read_table(source, columns=columns, memory_map=isinstance(source, (str, os.PathLike))).to_pandas()
+
+
+def read_table_bytes(data, name):
+    """read_table for in-memory contents, e.g. a Streamlit upload."""
+    return read_table(io.BytesIO(data), name=name)
+
+
+def iter_table_chunks(path, chunksize):
+    """Yield a table in DataFrames of at most `chunksize` rows without loading it all."""
+    file_format = table_format(path)
+    if file_format == CSV:
+        yield from pd.read_csv(path, chunksize=chunksize)
+        return
+    if file_format == PARQUET:
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize)
+    else:
+        from pyarrow import feather
+
+        batches = feather.read_table(path, memory_map=True).to_batches(max_chunksize=chunksize)
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+def write_table(df, path):
+    """Save a DataFrame (without its index) in the format its extension names."""
+    file_format = table_format(path)
+    if file_format == CSV:
+        df.to_csv(path, index=False)
+    elif file_format == PARQUET:
+        df.to_parquet(path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(path)
+
+
+def table_bytes(df, file_format):
+    """A DataFrame serialized as CSV, PARQUET or ARROW, e.g. for a download button."""
+    if file_format == CSV:
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    if file_format == PARQUET:
+        df.to_parquet(buffer, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(buffer)
+    return buffer.getvalue()
+
+
+def typed_columns(df):
+    """
+    Copy of `df` with yes/no text columns as nullable booleans and whole-number float
+    columns (integers with gaps, as read_csv leaves them) as nullable integers.
+    """
+    typed = df.copy()
+    for column in typed.columns:
+        values = typed[column]
+        present = values.dropna()
+        if not len(present):
+            continue
+        if values.dtype == object:
+            lowered = values.where(values.isna(), values.astype(str).str.strip().str.lower())
+            if lowered.dropna().isin(YES_NO.keys()).all():
+                typed[column] = lowered.map(YES_NO).astype("boolean")
+        elif pd.api.types.is_float_dtype(values) and (present == present.round()).all():
+            typed[column] = values.astype("Int64")
+    return typed
+
+
+def convert_table(source_path, target_path, typed=True):
+    """Rewrite a table in another format, inferring column types on the way unless `typed` is False."""
+    df = read_table(source_path)
+    write_table(typed_columns(df) if typed else df, target_path)
+    return df
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python storage.py SOURCE TARGET  (e.g. data/patient_panel.csv data/patient_panel.parquet)")
+    converted = convert_table(sys.argv[1], sys.argv[2])
+    print(f"✅ {len(converted)} row(s) written to {sys.argv[2]}")
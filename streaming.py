@@ -0,0 +1,102 @@
+"""
+Bounded-memory building blocks for prioritizing very large task files.
+
+A task file is processed one chunk at a time. Each chunk's ranked results are written
+as a sorted "run" file as soon as the chunk finishes, so a crash loses at most the chunk
+in flight and a restart skips every run already on disk. The final, globally ordered
+output is a k-way merge of the runs that holds a single row per run in memory.
+
+Runs live in a spill directory together with a manifest fingerprinting the inputs
+(task file, chunk size, rules, ...); if any of those change, the stale runs are discarded.
+"""
+import csv
+import hashlib
+import heapq
+import json
+import os
+import shutil
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_fingerprint(path):
+    """Cheap identity of a file on disk: absolute path, size and modification time."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def frame_digest(df):
+    """Content hash of a DataFrame, for detecting that a rules table or panel has changed."""
+    return hashlib.sha256(df.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+class ChunkRunStore:
+    """
+    Sorted per-chunk result files in `directory`, valid for one input `fingerprint`.
+
+    `fingerprint` is any JSON-serializable description of the inputs; a directory
+    written for a different fingerprint is cleared on open.
+    """
+
+    def __init__(self, directory, fingerprint):
+        self.directory = directory
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        fingerprint = json.loads(json.dumps(fingerprint))  # tuples → lists, as they'd come back from disk
+        if manifest != {"fingerprint": fingerprint}:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint}, f)
+
+    def path(self, chunk_number):
+        return os.path.join(self.directory, f"chunk_{chunk_number:06d}.csv")
+
+    def completed(self):
+        """Chunk numbers whose runs are fully written."""
+        return sorted(
+            int(name[len("chunk_"):-len(".csv")]) for name in os.listdir(self.directory)
+            if name.startswith("chunk_") and name.endswith(".csv")
+        )
+
+    def write(self, chunk_number, sorted_df):
+        """Store one chunk's sorted results; the file only appears once it is complete."""
+        partial_path = self.path(chunk_number) + ".partial"
+        sorted_df.to_csv(partial_path, index=False)
+        os.replace(partial_path, self.path(chunk_number))
+
+    def run_paths(self):
+        return [self.path(chunk_number) for chunk_number in self.completed()]
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def merge_sorted_runs(run_paths, output_path, sort_key):
+    """
+    K-way merge of CSV runs, each already sorted by `sort_key`, into `output_path`.
+
+    `sort_key` maps a row (dict of strings) to a comparable value. Rows with equal keys
+    keep run order. Runs may have different columns. Returns the number of rows written.
+    """
+    files = [open(path, newline="", encoding="utf-8") for path in run_paths]
+    try:
+        readers = [csv.DictReader(f) for f in files]
+        # Union of the runs' columns, in first-seen order; rows missing a column get ""
+        fieldnames = list(dict.fromkeys(name for reader in readers for name in reader.fieldnames or []))
+        partial_path = output_path + ".partial"
+        rows_written = 0
+        with open(partial_path, "w", newline="", encoding="utf-8") as out:
+            writer = csv.DictWriter(out, fieldnames=fieldnames)
+            writer.writeheader()
+            for row in heapq.merge(*readers, key=sort_key):
+                writer.writerow(row)
+                rows_written += 1
+        os.replace(partial_path, output_path)
+        return rows_written
+    finally:
+        for f in files:
+            f.close()
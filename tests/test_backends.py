@@ -0,0 +1,47 @@
+import ollama
+import pytest
+
+import main
+from backends import OllamaBackend
+
+
+def logprob(token, value, top=()):
+    return {"token": token, "logprob": value, "top_logprobs": [{"token": t, "logprob": v} for t, v in top]}
+
+
+@pytest.fixture
+def reply(monkeypatch):
+    """Set the canned ollama.chat response: reply(content, logprobs)."""
+    response = {}
+
+    def set_reply(content, logprobs=None):
+        response.update(message={"content": content}, logprobs=logprobs)
+
+    monkeypatch.setattr(ollama, "chat", lambda **request: response)
+    return set_reply
+
+
+@pytest.mark.parametrize("content, first_tokens, answer", [
+    ("In my view: Clinical Stability", [("In", -0.05), ("Individual", -3.0), ("Clinical", -4.0)], "Clinical Stability"),
+    ("So this is Social Stability", [("So", -0.1), ("Social", -2.5)], "Social Stability"),
+])
+def test_prose_reply_resolves_to_the_named_label(reply, content, first_tokens, answer):
+    (token, value), *top = first_tokens
+    reply(content, [logprob(token, value, first_tokens)] + [logprob("x", -0.1)] * 3)
+    probabilities = OllamaBackend().label_probabilities("prefix", "suffix", main.CATEGORIES)
+    assert probabilities == {category: float(category == answer) for category in main.CATEGORIES}
+
+
+def test_logprobs_used_when_the_reply_starts_with_the_label(reply):
+    reply("Clinical Stability", [
+        logprob(" Clinical", -0.1, [(" Clinical", -0.1), ("Social", -2.5), ("In", -1.0)]), logprob(" Stability", -0.01),
+    ])
+    probabilities = OllamaBackend().label_probabilities("prefix", "suffix", main.CATEGORIES)
+    assert max(probabilities, key=probabilities.get) == "Clinical Stability"
+    assert 0 < probabilities["Social Stability"] < probabilities["Clinical Stability"] < 1
+    assert probabilities["Individual Agency"] == 0.0
+
+
+def test_reply_naming_no_label_is_unresolved(reply):
+    reply("In my view it depends", [logprob("In", -0.05, [("Individual", -3.0)])])
+    assert OllamaBackend().label_probabilities("prefix", "suffix", main.CATEGORIES) is None
@@ -0,0 +1,42 @@
+import pandas as pd
+
+import main
+from checkpoint import TaskCheckpoint, task_keys
+from classification_cache import ClassificationCache
+
+EXAMPLES = pd.DataFrame({"Task": ["Refill prescription"], "risk_factor_stage": ["Medication Adherence"]})
+
+
+class ScriptedBackend:
+    """Answers label_probabilities from a {task text: probabilities or None} script."""
+
+    model = "scripted"
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = 0
+
+    def label_probabilities(self, prefix, suffix, labels):
+        self.calls += 1
+        return next(answer for task, answer in self.answers.items() if task in suffix)
+
+
+def test_unresolved_answers_are_not_cached_or_checkpointed(tmp_path):
+    backend = ScriptedBackend({
+        "Call the pharmacy": {category: float(category == "Medication Adherence") for category in main.CATEGORIES},
+        "Mumble": None,
+    })
+    cache = ClassificationCache(str(tmp_path / "cache"))
+    checkpoint = TaskCheckpoint("run", str(tmp_path / "checkpoints.sqlite"))
+    tasks = pd.DataFrame({"patient_id": [1, 2], "TASK": ["Call the pharmacy", "Mumble"]})
+
+    classification = main.classify_panel(tasks, EXAMPLES, cache=cache, backend=backend, max_workers=1, checkpoint=checkpoint)
+    assert classification["Predicted Category"].tolist() == ["Medication Adherence", None]
+    assert classification["Classification Source"].tolist() == ["llm", "unresolved"]
+    assert [result[0] for result in checkpoint.load(task_keys(tasks)).values()] == ["Medication Adherence"]
+    checkpoint.close()
+
+    # The resolved task comes from the cache; the unresolved one is asked again
+    classification = main.classify_panel(tasks, EXAMPLES, cache=cache, backend=backend, max_workers=1)
+    assert backend.calls == 3
+    cache.close()
@@ -0,0 +1,67 @@
+"""The visit-note coach's prompt caching, driven offline through fake_client.FakeAnthropicClient."""
+import os
+import sys
+
+import pytest
+
+# Appended, not prepended: the coach has its own main.py, and the pipeline's must win
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conversational_documentation"))
+
+import llm  # noqa: E402
+from fake_client import MIN_CACHEABLE_TOKENS, FakeAnthropicClient  # noqa: E402
+from patient_data import PATIENTS  # noqa: E402
+
+LONG_INSTRUCTION = "Check every required field against the visit note. " * 100  # > MIN_CACHEABLE_TOKENS
+
+
+@pytest.fixture
+def client():
+    client = FakeAnthropicClient(reply="What is the housing status?")
+    llm.set_client(client)
+    yield client
+    llm.set_client(None)
+
+
+def ask(note, system, stream):
+    usages = []
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": note}]
+    reply = llm.ask_llm(messages, stream=stream, on_usage=usages.append)
+    if stream:
+        reply = "".join(reply)
+    return reply, usages
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["create", "stream"])
+def test_long_system_prompt_is_written_then_read(client, stream):
+    reply, usages = ask("First visit", LONG_INSTRUCTION, stream)
+    assert reply == "What is the housing status?"
+    assert usages[0]["cache_creation_input_tokens"] >= MIN_CACHEABLE_TOKENS
+    assert usages[0]["cache_read_input_tokens"] == 0
+
+    _, usages = ask("Second visit", LONG_INSTRUCTION, stream)
+    assert usages[0]["cache_read_input_tokens"] >= MIN_CACHEABLE_TOKENS
+    assert usages[0]["cache_creation_input_tokens"] == 0
+    assert client.requests[-1]["system"][-1]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_usage_is_reported_after_the_streamed_reply(client):
+    usages = []
+    deltas = llm.ask_llm(
+        [{"role": "system", "content": LONG_INSTRUCTION}, {"role": "user", "content": "Visit"}],
+        stream=True, on_usage=usages.append,
+    )
+    assert next(deltas) and not usages
+    list(deltas)
+    assert len(usages) == 1
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["create", "stream"])
+def test_shipped_profiles_are_below_the_cache_minimum(client, stream):
+    """The current instruction plus field list is too short for the provider to cache."""
+    for note in ("First visit", "Second visit"):
+        messages = llm.get_structured_prompt(note, PATIENTS[1])
+        usages = []
+        reply = llm.ask_llm(messages, stream=stream, on_usage=usages.append)
+        if stream:
+            list(reply)
+        assert usages[0]["cache_read_input_tokens"] == usages[0]["cache_creation_input_tokens"] == 0
@@ -0,0 +1,50 @@
+import threading
+
+import pandas as pd
+
+import instrumentation
+import main
+
+EXAMPLES = pd.DataFrame({"Task": ["Refill prescription"], "risk_factor_stage": ["Medication Adherence"]})
+
+
+class OneHotBackend:
+    model = "one-hot"
+
+    def label_probabilities(self, prefix, suffix, labels):
+        return {label: float(label == labels[0]) for label in labels}
+
+
+def test_overlapping_runs_record_only_their_own_work():
+    both_collecting, both_counted = threading.Barrier(2), threading.Barrier(2)
+    reports = {}
+
+    def run(name):
+        with instrumentation.collect() as stats:
+            both_collecting.wait()
+            instrumentation.count(name)
+            with instrumentation.stage(name):
+                pass
+            both_counted.wait()
+        reports[name] = stats.report()
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ("first", "second")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name in ("first", "second"):
+        assert reports[name]["counters"] == {name: 1}
+        assert list(reports[name]["stages"]) == [name]
+    assert not instrumentation.enabled()
+
+
+def test_classifier_pool_records_into_the_callers_run():
+    tasks = ["Call the pharmacy", "Book a ride", "Check blood pressure"]
+    with instrumentation.collect() as stats:
+        results = list(main.classify_tasks_concurrently(tasks, EXAMPLES, max_workers=2, batch_size=1, backend=OneHotBackend()))
+    assert len(results) == len(tasks)
+    report = stats.report()
+    assert report["counters"]["llm_calls"] == len(tasks)
+    assert report["stages"]["llm_call"]["calls"] == len(tasks)
@@ -0,0 +1,26 @@
+import re
+
+from keyword_matcher import KeywordMatcher
+
+KEYWORDS = ["plan", "safety plan", "planning", "relapse", "warning signs", "signs", "re", "pcp", "-care"]
+TEXTS = [
+    "Review SAFETY PLAN and relapse warning signs",
+    "Planning session with PCP (re-care)",
+    "Discuss re-engagement plan_b",
+    "",
+]
+
+
+def test_matches_substring_scan():
+    matcher = KeywordMatcher(KEYWORDS)
+    for text in TEXTS:
+        assert matcher.find(text) == {keyword for keyword in KEYWORDS if keyword in text.lower()}
+    assert matcher.find(None) == set()
+
+
+def test_whole_words_match_word_boundaries():
+    matcher = KeywordMatcher(KEYWORDS, whole_words=True)
+    for text in TEXTS:
+        expected = {keyword for keyword in KEYWORDS if re.search(rf"\b{re.escape(keyword)}\b", text.lower())}
+        assert matcher.find(text) == expected
+    assert matcher.find("planning") == {"planning"}
@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+import main
+from knn_classifier import KNNClassifier
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def test_labels_are_normalized_to_categories():
+    examples = pd.DataFrame({
+        "Task": ["Refill antipsychotic prescription", "Pick up medication from pharmacy", "Register for patient portal access"],
+        "risk_factor_stage": [" Medication Adherence", "Medication Adherence", "Community Providers"],
+    })
+    training = pd.DataFrame({
+        "Task": ["Register for patient portal access", "Apply for housing voucher"],
+        "risk_factor_stage": ["Individual Agency", "Social Stability"],
+    })
+    knn = KNNClassifier.from_frames(examples, training, normalize_label=main.normalize_category)
+
+    # The non-category row is dropped, so the same text from the training set is kept instead
+    assert list(knn.labels) == ["Individual Agency", "Medication Adherence", "Social Stability"]
+    labels, _ = knn.predict(["Refill medication at the pharmacy", "Register for portal access"])
+    assert labels == ["Medication Adherence", "Individual Agency"]
+
+
+def test_shipped_examples_only_predict_categories():
+    knn = KNNClassifier.from_frames(
+        pd.read_csv(os.path.join(DATA_DIR, "curated_examples.csv")), pd.read_csv(os.path.join(DATA_DIR, "training_tasks.csv")),
+        normalize_label=main.normalize_category,
+    )
+    assert set(knn.labels) <= set(main.CATEGORIES)
+    labels, _ = knn.predict([
+        "Help register for patient portal access", "Discuss switching from oral risperidone to Invega Sustenna",
+    ])
+    assert set(labels) <= set(main.CATEGORIES)
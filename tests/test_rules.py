@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+from rules import RuleValidationError, compile_rules
+
+COLUMNS = [
+    "rule_id", "task_category", "keyword", "patient_field", "patient_field_operator", "patient_field_value",
+    "points", "condition_field", "condition_value",
+]
+
+
+def test_blank_rows_are_skipped():
+    rules = pd.DataFrame([
+        {"rule_id": 1, "task_category": "Clinical Stability", "points": 4},
+        {column: None for column in COLUMNS},
+        {"keyword": "  ", "points": float("nan")},
+    ], columns=COLUMNS)
+    assert [rule["rule_id"] for rule in compile_rules(rules)] == [1]
+
+
+def test_rules_without_rule_id_are_named_by_row():
+    rules = pd.DataFrame([
+        {"rule_id": 1, "task_category": "Clinical Stability", "points": 4},
+        {"keyword": "crisis"},
+        {"rule_id": 7, "patient_field": "days_engaged", "patient_field_operator": "<", "patient_field_value": "soon",
+         "points": 1},
+    ], columns=COLUMNS)
+    with pytest.raises(RuleValidationError) as error:
+        compile_rules(rules)
+    assert error.value.errors[0].startswith("Row 2: points must be a number")
+    assert error.value.errors[1].startswith("Rule 7: operator '<' needs a number")
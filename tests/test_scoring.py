@@ -0,0 +1,168 @@
+"""
+Parity of the rule engine with a row-by-row reference: PanelScorer.score (through
+CompiledRules.score) and main.rank_task (through CompiledRules.score_task and the
+rule index) must give every task the same priority rank, score and reason lines as
+reference_rank_task, which tests every rule against the task in turn.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import main
+from patients import PatientStore
+from rules import display_value
+from scoring import CompiledRules, priority_ranks_for_scores
+from storage import typed_columns
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# in, !=, numeric and conditional rules on top of the shipped table
+EXTRA_RULES = [
+    {"rule_id": 17, "patient_field": "primary_bh_diagnosis", "patient_field_operator": "in",
+     "patient_field_value": "['bipolar', 'MDD']", "points": 2},
+    {"rule_id": 18, "patient_field": "suicidal_ideation_risk", "patient_field_operator": "!=",
+     "patient_field_value": "recent", "points": 1},
+    {"rule_id": 19, "patient_field": "days_engaged", "patient_field_operator": ">=",
+     "patient_field_value": "200", "points": 1},
+    {"rule_id": 20, "patient_field": "days_engaged", "patient_field_operator": "<=",
+     "patient_field_value": "60", "points": 2, "condition_field": "high_utilizer", "condition_value": "yes"},
+    {"rule_id": 21, "task_category": "Social Stability", "keyword": "housing", "patient_field": "unhoused",
+     "patient_field_operator": "==", "patient_field_value": "yes", "points": 3,
+     "condition_field": "transportation_access", "condition_value": "no"},
+    {"rule_id": 22, "keyword": "appointment", "points": 2, "condition_field": "days_engaged", "condition_value": "20"},
+    {"rule_id": 23, "patient_field": "days_engaged", "patient_field_operator": ">",
+     "patient_field_value": "150.5", "points": 1},
+]
+
+
+def reference_rank_task(task_text, predicted_category, patient_info, priority_rules_df):
+    """Score one task by walking every rule in order; the engine's reference semantics."""
+    patient_info = patient_info if patient_info is not None else {}  # no patient: task rules only
+    score = 0
+    point_reasons = []
+    for _, rule in priority_rules_df.iterrows():
+        match = False
+        reasons_to_add = []
+
+        if isinstance(rule["task_category"], str) and predicted_category == rule["task_category"]:
+            match = True
+            reasons_to_add.append(f"Matched Task Category: {rule['task_category']}")
+
+        if isinstance(rule["keyword"], str) and rule["keyword"].lower() in task_text.lower():
+            match = True
+            reasons_to_add.append(f"Matched Keyword: {rule['keyword']}")
+
+        if isinstance(rule["patient_field"], str):
+            patient_value = patient_info.get(rule["patient_field"], None)
+            if patient_value is not None:
+                if main.apply_operator(patient_value, rule["patient_field_operator"], rule["patient_field_value"]):
+                    match = True
+                    reasons_to_add.append(f"Matched Patient Field: {rule['patient_field']}={display_value(patient_value)}")
+
+        # The condition is checked after the criteria and discards their reasons if it fails
+        if match and isinstance(rule.get("condition_field"), str):
+            if not main.apply_operator(patient_info.get(rule["condition_field"], None), "==", rule["condition_value"]):
+                match = False
+
+        if match:
+            score += rule["points"]
+            point_reasons.extend(reasons_to_add)
+            point_reasons.append(f"+{rule['points']} points from Rule {rule['rule_id']}")
+
+    return int(priority_ranks_for_scores(score)), score, point_reasons
+
+
+SYNTHETIC_TASKS = [
+    "Review SAFETY PLAN and relapse warning signs",
+    "Help find housing and schedule an appointment",
+    "Crisis follow-up call",
+]
+
+
+def load_rules(extra=True):
+    rules = pd.read_csv(os.path.join(DATA_DIR, "priority_rules_updated.csv"))
+    if extra:
+        rules = pd.concat([rules, pd.DataFrame(EXTRA_RULES)], ignore_index=True)
+    return rules
+
+
+def load_tasks(store):
+    """
+    The shipped patient-linked tasks plus keyword-heavy tasks for every panel patient,
+    limited to patients in `store`, with categories assigned round-robin.
+    """
+    shipped = pd.concat([
+        pd.read_csv(os.path.join(DATA_DIR, name)) for name in ("unlabeled_tasks_2025-04-25.csv", "event_triggered_tasks.csv")
+    ], ignore_index=True)
+    synthetic = pd.DataFrame([
+        {"patient_id": patient_id, "TASK": text}
+        for patient_id in store.panel["patient_id"]
+        for text in SYNTHETIC_TASKS
+    ])
+    tasks = pd.concat([shipped, synthetic], ignore_index=True)
+    tasks = tasks[tasks["patient_id"].map(lambda patient_id: patient_id in store)].reset_index(drop=True)
+    categories = [main.CATEGORIES[i % len(main.CATEGORIES)] for i in range(len(tasks))]
+    return tasks, categories
+
+
+@pytest.fixture(params=["csv", "typed"])
+def panel(request):
+    panel_df = pd.read_csv(os.path.join(DATA_DIR, "patient_panel.csv"))
+    return typed_columns(panel_df) if request.param == "typed" else panel_df
+
+
+@pytest.mark.parametrize("extra", [False, True], ids=["shipped", "extra"])
+def test_engine_matches_reference(panel, extra):
+    rules = load_rules(extra)
+    store = PatientStore(panel)
+    tasks, categories = load_tasks(store)
+    compiled = CompiledRules(rules)
+    ranks, scores, matches = compiled.score(tasks["TASK"].tolist(), categories, *store.join(tasks["patient_id"]))
+
+    for i, (task, category, patient_id) in enumerate(zip(tasks["TASK"], categories, tasks["patient_id"])):
+        patient = store.get(patient_id)
+        expected = reference_rank_task(task, category, patient, rules)
+        assert (ranks[i], scores[i], matches.explain(i)) == expected, task
+        assert main.rank_task(task, category, patient, compiled) == expected, task
+
+
+def test_condition_compares_normalized_values():
+    """
+    An integer patient value meets a condition written as text ("20" from the CSV).
+    The original row-by-row rank_task compared them raw, so this rule never fired; that change is intended.
+    """
+    rules = pd.DataFrame([EXTRA_RULES[5]], columns=load_rules(extra=False).columns)
+    patient = pd.Series({"patient_id": 2, "days_engaged": 20})
+    expected = (4, 2, ["Matched Keyword: appointment", "+2 points from Rule 22"])
+
+    assert reference_rank_task("Schedule appointment", "Social Stability", patient, rules) == expected
+    assert main.rank_task("Schedule appointment", "Social Stability", patient, rules) == expected
+    ranks, scores, matches = CompiledRules(rules).score(["Schedule appointment"], ["Social Stability"], patient.to_frame().T)
+    assert (ranks[0], scores[0], matches.explain(0)) == expected
+
+
+def test_unmatched_patients_get_task_rules_only():
+    rules = pd.concat([load_rules(extra=False), pd.DataFrame([
+        {"rule_id": 17, "patient_field": "unhoused", "patient_field_operator": "!=", "patient_field_value": "yes",
+         "points": 3},
+        {"rule_id": 18, "keyword": "crisis", "points": 1, "condition_field": "unhoused", "condition_value": "no"},
+    ])], ignore_index=True)
+    store = PatientStore(pd.read_csv(os.path.join(DATA_DIR, "patient_panel.csv")))
+    tasks = pd.DataFrame({"patient_id": [999, 1], "patient_name": ["Nobody", "Eric Henson"], "TASK": ["Crisis call"] * 2})
+    categories = ["Social Stability"] * 2
+    expected = (
+        2, 8,
+        ["Matched Task Category: Social Stability", "+3 points from Rule 3", "Matched Keyword: crisis", "+5 points from Rule 9"],
+    )
+
+    compiled = CompiledRules(rules)
+    assert reference_rank_task("Crisis call", "Social Stability", store.get(999), rules) == expected
+    assert main.rank_task("Crisis call", "Social Stability", store.get(999), compiled) == expected
+    ranks, scores, matches = compiled.score(tasks["TASK"].tolist(), categories, *store.join(tasks["patient_id"]))
+    assert (ranks[0], scores[0], matches.explain(0)) == expected
+    # The matched patient still gets the `!=` and conditional rules
+    assert "+3 points from Rule 17" in matches.explain(1) and "+1 points from Rule 18" in matches.explain(1)
+
+    output_df = main.score_tasks(tasks, main.panel_scorer(tasks, categories, store), compiled)
+    assert output_df.set_index("Patient ID").loc[999, "Priority Score"] == 8